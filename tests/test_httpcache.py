@@ -0,0 +1,108 @@
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timesearch_modules import httpcache
+
+URL = 'https://api.pushshift.io/reddit/comment/search'
+
+class FakePushshift:
+    '''
+    Serves pages of items newer than `after` and older than `before`, oldest
+    first, like pushshift's search does with sort=asc.
+    '''
+    def __init__(self, createds):
+        self.createds = sorted(createds)
+        self.requests = 0
+
+    def search(self, params):
+        self.requests += 1
+        after = params.get('after', -1)
+        before = params.get('before', float('inf'))
+        createds = [c for c in self.createds if after < c < before][:params['size']]
+        return {'data': [{'created_utc': c} for c in createds]}
+
+def scan(cache, server, lower, upper=None):
+    '''
+    Paginate the way pushshift._pagination_core does, reading through the
+    cache the way pushshift.get does.
+    '''
+    results = []
+    params = {'after': lower, 'size': 3}
+    if upper is not None:
+        params['before'] = upper
+    while True:
+        body = cache.get(URL, params)
+        if body is None:
+            body = json.dumps(server.search(params)).encode('utf-8')
+            cache.put(URL, params, body)
+        page = [item['created_utc'] for item in json.loads(body)['data']]
+        if not page:
+            return results
+        results.extend(page)
+        params = {**params, 'after': page[-1]}
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = httpcache.ResponseCache(self.directory.name)
+
+    def tearDown(self):
+        self.cache.sql.close()
+        self.directory.cleanup()
+
+    def test_update_scan_sees_new_items(self):
+        server = FakePushshift(range(1000, 1010))
+        first = scan(self.cache, server, lower=0)
+        self.assertEqual(first, list(range(1000, 1010)))
+
+        server.createds.extend(range(2000, 2005))
+        # get_comments --lower update starts just before the newest item.
+        second = scan(self.cache, server, lower=max(first) - 1)
+        self.assertEqual(second, [1009, 2000, 2001, 2002, 2003, 2004])
+
+    def test_closed_window_is_cached(self):
+        server = FakePushshift(range(1000, 1010))
+        upper = int(time.time()) - 2 * httpcache.SETTLE_TIME
+        first = scan(self.cache, server, lower=0, upper=upper)
+        requests = server.requests
+
+        second = scan(self.cache, server, lower=0, upper=upper)
+        self.assertEqual(first, second)
+        self.assertEqual(server.requests, requests)
+
+    def test_resumed_backfill_is_cached(self):
+        # A backfill without an upper bound never sends `before`, but its
+        # full pages of old items can't change.
+        server = FakePushshift(range(1000, 1010))
+        first = scan(self.cache, server, lower=0)
+        requests = server.requests
+
+        second = scan(self.cache, server, lower=0)
+        self.assertEqual(first, second)
+        # Only the last two pages, which weren't full, are requested again.
+        self.assertEqual(server.requests, requests + 2)
+
+    def test_recent_window_is_not_cached(self):
+        now = int(time.time())
+        server = FakePushshift(range(now - 100, now - 90))
+        upper = now
+        scan(self.cache, server, lower=0, upper=upper)
+        requests = server.requests
+
+        scan(self.cache, server, lower=0, upper=upper)
+        self.assertEqual(server.requests, 2 * requests)
+
+    def test_replay_only_replays_open_pages(self):
+        server = FakePushshift(range(1000, 1010))
+        first = scan(self.cache, server, lower=0)
+        self.cache.replay_only = True
+        self.assertEqual(scan(self.cache, server, lower=0), first)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timesearch_modules import ingest_jsonfile
+from timesearch_modules import tsdb
+
+def comment(id, subreddit, author):
+    return {
+        'id': id,
+        'created_utc': 1600000000,
+        'author': author,
+        'body': 'hello',
+        'link_id': 't3_abc',
+        'parent_id': 't3_abc',
+        'subreddit': subreddit,
+        'score': 1,
+    }
+
+class RoutedIngestTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.json_file = os.path.join(self.directory.name, 'RC_sample.json')
+        comments = [
+            comment('c1', 'pics', 'alice'),
+            comment('c2', 'Pics', 'bob'),
+            comment('c3', 'funny', 'alice'),
+        ]
+        with open(self.json_file, 'w', encoding='utf-8') as handle:
+            handle.write(''.join(json.dumps(c) + '\n' for c in comments))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def count(self, filepath):
+        database = tsdb.TSDB(filepath, do_create=False)
+        count = database.sql.execute('SELECT COUNT(*) FROM comments').fetchone()[0]
+        database.close()
+        return count
+
+    def test_database_paths_are_routed_by_name(self):
+        pics = os.path.join(self.directory.name, 'pics.db')
+        alice = os.path.join(self.directory.name, '@alice.db')
+        ingest_jsonfile.ingest_jsonfile_routed(
+            self.json_file,
+            subreddits=[pics],
+            usernames=[alice],
+        )
+        self.assertEqual(self.count(pics), 2)
+        self.assertEqual(self.count(alice), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'utilities'))
+
+import database_upgrader
+from timesearch_modules import tsdb
+
+class QueryPlanTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = tsdb.TSDB(os.path.join(self.directory.name, 'test.db'))
+
+    def tearDown(self):
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_new_database_uses_indices(self):
+        self.assertEqual(database_upgrader.check_query_plans(self.database), [])
+
+    def test_optional_indices_are_used(self):
+        self.database.create_optional_indices()
+        self.assertEqual(database_upgrader.check_query_plans(self.database), [])
+
+    def test_missing_index_is_reported(self):
+        self.database.sql.execute('DROP INDEX comment_submission_index')
+        failures = database_upgrader.check_query_plans(self.database)
+        self.assertEqual(len(failures), 2)
+        self.assertTrue(all('comments' in query for (query, plan) in failures))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,6 +19,118 @@ from timesearch_modules import exceptions
 # of other things. This made TS very slow to load which is okay when you're
 # actually using it but really terrible when you're just viewing the help text.
 
+def add_http_cache_arguments(parser):
+    parser.add_argument(
+        '--http_cache',
+        '--http-cache',
+        dest='http_cache',
+        default=None,
+        help='''
+        A folder in which to keep the pushshift responses, so that if the scan
+        is interrupted, running it again does not need to download the same
+        pages again.
+        ''',
+    )
+    parser.add_argument(
+        '--http_cache_size',
+        '--http-cache-size',
+        dest='http_cache_size',
+        default=None,
+        help='''
+        The most megabytes the http cache may use. When it's full, the least
+        recently used responses are removed. Default 2048.
+        ''',
+    )
+    parser.add_argument(
+        '--replay_only',
+        '--replay-only',
+        dest='replay_only',
+        action='store_true',
+        help='''
+        If provided, only use the responses already in the http cache, and
+        stop with an error if one is missing, instead of making a request.
+        ''',
+    )
+
+def add_pragma_profile_argument(parser):
+    parser.add_argument(
+        '--pragma_profile',
+        '--pragma-profile',
+        dest='pragma_profile',
+        default=None,
+        help='''
+        Choose the SQLite performance settings for the database. One of
+        "default", "bulk-ingest", "livestream", "reporting".
+        The choice is saved in the database and used again next time, until
+        you choose a different one.
+        ''',
+    )
+
+def add_concurrency_argument(parser):
+    parser.add_argument(
+        '--concurrency',
+        dest='concurrency',
+        default=None,
+        help='''
+        Split the time range into windows and download this many of them from
+        pushshift at the same time. The requests still share the same
+        ratelimit, but you spend less time waiting on slow responses.
+        ''',
+    )
+
+def add_refresh_ttl_argument(parser):
+    parser.add_argument(
+        '--refresh_ttl',
+        '--refresh-ttl',
+        dest='refresh_ttl',
+        default=None,
+        help='''
+        Do not ask reddit for the live copy of items that were already
+        refreshed within this many seconds, e.g. 86400 for one day.
+        ''',
+    )
+
+def add_refresh_arguments(parser):
+    add_refresh_ttl_argument(parser)
+    parser.add_argument(
+        '--refresh_max_age',
+        '--refresh-max-age',
+        dest='refresh_max_age',
+        default=None,
+        help='''
+        Do not ask reddit for the live copy of items that were already this
+        many seconds old the last time they were refreshed, because their
+        scores have settled. E.g. 15552000 for six months.
+        ''',
+    )
+
+def add_shared_ratelimit_arguments(parser):
+    parser.add_argument(
+        '--shared_ratelimit',
+        '--shared-ratelimit',
+        dest='shared_ratelimit',
+        nargs='?',
+        const='',
+        default=None,
+        help='''
+        If provided, split the pushshift and reddit ratelimits with all the
+        other timesearch processes on this computer that use this flag, so
+        that together they stay within the limits. You may give the path of
+        the file they use to coordinate, otherwise one in your temp folder is
+        used.
+        ''',
+    )
+    parser.add_argument(
+        '--ratelimit_share',
+        '--ratelimit-share',
+        dest='ratelimit_share',
+        default=None,
+        help='''
+        This process's weight in the --shared_ratelimit split, default 1. A
+        process with share 2 gets twice as many requests as one with share 1.
+        ''',
+    )
+
 def breakdown_gateway(args):
     from timesearch_modules import breakdown
     breakdown.breakdown_argparse(args)
@@ -51,6 +163,10 @@ def offline_reading_gateway(args):
     from timesearch_modules import offline_reading
     offline_reading.offline_reading_argparse(args)
 
+def refresh_gateway(args):
+    from timesearch_modules import refresh
+    refresh.refresh_argparse(args)
+
 def index_gateway(args):
     from timesearch_modules import index
     index.index_argparse(args)
@@ -180,6 +296,11 @@ def main(argv):
         If not provided - stop at current time.
         ''',
     )
+    add_concurrency_argument(p_get_comments)
+    add_http_cache_arguments(p_get_comments)
+    add_shared_ratelimit_arguments(p_get_comments)
+    add_refresh_arguments(p_get_comments)
+    add_pragma_profile_argument(p_get_comments)
     p_get_comments.set_defaults(func=get_comments_gateway)
 
     # GET_STYLES
@@ -231,6 +352,9 @@ def main(argv):
         help='''
         Path to a file containing 1 json object per line. Each object must be
         either a submission or a comment.
+
+        Files ending in .zst, .gz, or .xz will be decompressed as they are
+        read, so you don't need to extract them first.
         ''',
     )
     p_ingest_jsonfile.add_argument(
@@ -245,6 +369,50 @@ def main(argv):
         dest='username',
         default=None,
     )
+    p_ingest_jsonfile.add_argument(
+        '--workers',
+        dest='workers',
+        type=int,
+        default=None,
+        help='''
+        Parse the file using this many worker processes, while the main
+        process writes to the database. If the orjson module is installed, it
+        will be used to parse the json faster.
+        ''',
+    )
+    p_ingest_jsonfile.add_argument(
+        '--route',
+        dest='route',
+        action='store_true',
+        help='''
+        The file is a combined dump of many subreddits, like the monthly RC_
+        and RS_ files. Only the items belonging to the subreddits given by -r
+        or the users given by -u are kept, and each goes into its own
+        database. You may give several names separated by + or commas.
+        The file is only read once no matter how many names there are.
+        ''',
+    )
+    p_ingest_jsonfile.add_argument(
+        '--watch_file',
+        '--watch-file',
+        dest='watch_file',
+        default=None,
+        help='''
+        Implies --route. A text file with one subreddit name per line, or
+        @username for users, to route in addition to -r and -u.
+        ''',
+    )
+    p_ingest_jsonfile.add_argument(
+        '--restart',
+        dest='restart',
+        action='store_true',
+        help='''
+        If this file was ingested before, or was interrupted partway through,
+        timesearch will normally continue from where it stopped. With this
+        flag, start over from the beginning of the file instead.
+        ''',
+    )
+    add_pragma_profile_argument(p_ingest_jsonfile)
     p_ingest_jsonfile.set_defaults(func=ingest_jsonfile_gateway)
 
     # LIVESTREAM
@@ -274,6 +442,43 @@ def main(argv):
         BOTH be collected.
         ''',
     )
+    p_livestream.add_argument(
+        '--config',
+        dest='config',
+        default=None,
+        help='''
+        A json file listing the subreddits and users to collect from, instead
+        of -r and -u. Each one can have its own options:
+
+        {"defaults": {"comments": false},
+         "sources": [
+            {"subreddit": "askreddit", "comments": true, "priority": 1},
+            {"subreddit": "learnpython", "interval": 300},
+            {"user": "gallowboob", "limit": 25}
+        ]}
+
+        "submissions", "comments", and "limit" work like the flags. Sources
+        with a higher "priority" are fetched first when the workers are busy.
+        "interval" polls the source every this many seconds instead of
+        adapting to its activity.
+
+        The file is checked every few seconds, and edits take effect without
+        restarting. The sources that are still listed keep their databases
+        open and their place in the schedule.
+        ''',
+    )
+    p_livestream.add_argument(
+        '--group_size',
+        '--group-size',
+        dest='group_size',
+        default=1,
+        help='''
+        Fetch up to this many subreddits together in one request, as a
+        multireddit like a+b+c, and sort the items into their own databases
+        afterwards. This makes far fewer requests, but --limit then applies
+        to the whole group, so busy subreddits should get a small group.
+        ''',
+    )
     p_livestream.add_argument(
         '--limit',
         dest='limit',
@@ -283,6 +488,58 @@ def main(argv):
         Number of items to fetch per request.
         ''',
     )
+    p_livestream.add_argument(
+        '--max_wait',
+        '--max-wait',
+        dest='max_sleepy',
+        default=None,
+        help='''
+        The most seconds to wait between cycles of a quiet subreddit / user.
+        Default is 600, or --wait if that's larger. Set --min_wait and
+        --max_wait to the same as --wait to always wait the same amount.
+        ''',
+    )
+    p_livestream.add_argument(
+        '--metrics_file',
+        '--metrics-file',
+        dest='metrics_file',
+        default=None,
+        help='''
+        Rewrite this file with Prometheus-format metrics every
+        --metrics_interval seconds: each subreddit / user's poll and insert
+        times, new and updated items, ingest lag, and errors. This works with
+        node_exporter's textfile collector, or just to read.
+        ''',
+    )
+    p_livestream.add_argument(
+        '--metrics_interval',
+        '--metrics-interval',
+        dest='metrics_interval',
+        default=15,
+        help='''
+        The number of seconds between rewrites of --metrics_file.
+        ''',
+    )
+    p_livestream.add_argument(
+        '--metrics_port',
+        '--metrics-port',
+        dest='metrics_port',
+        default=None,
+        help='''
+        Serve the same metrics as --metrics_file at
+        http://127.0.0.1:port/metrics, for Prometheus to scrape.
+        ''',
+    )
+    p_livestream.add_argument(
+        '--min_wait',
+        '--min-wait',
+        dest='min_sleepy',
+        default=None,
+        help='''
+        The fewest seconds to wait between cycles of a busy subreddit / user.
+        Default is 5, or --wait if that's smaller.
+        ''',
+    )
     p_livestream.add_argument(
         '-r',
         '--subreddit',
@@ -319,9 +576,24 @@ def main(argv):
         dest='sleepy',
         default=30,
         help='''
-        The number of seconds to wait between cycles.
+        The number of seconds to wait between the first cycles. After that,
+        each subreddit / user is polled more often if it's busy and less often
+        if it's quiet, between --min_wait and --max_wait.
         ''',
     )
+    p_livestream.add_argument(
+        '--workers',
+        dest='workers',
+        default=1,
+        help='''
+        The number of subreddits / users to fetch from reddit at the same time.
+        With many sources, this keeps one slow source from holding up the
+        others. Each worker logs in to reddit separately, but they share
+        one ratelimit.
+        ''',
+    )
+    add_shared_ratelimit_arguments(p_livestream)
+    add_pragma_profile_argument(p_livestream)
     p_livestream.set_defaults(func=livestream_gateway)
 
     # MERGEDB'
@@ -386,8 +658,108 @@ def main(argv):
         dest='username',
         default=None,
     )
+    add_pragma_profile_argument(p_offline_reading)
     p_offline_reading.set_defaults(func=offline_reading_gateway)
 
+    # REFRESH
+    p_refresh = subparsers.add_parser(
+        'refresh',
+        description='''
+        Update the scores, comment counts, and edited text of the items
+        already in the database using reddit's /api/info. This does not use
+        pushshift, it only refreshes items you have already collected.
+        ''',
+    )
+    p_refresh.add_argument(
+        '-c',
+        '--comments',
+        dest='comments',
+        action='store_true',
+        help='''
+        If provided, do refresh comments. Otherwise don't.
+
+        If submissions and comments are BOTH left unspecified, then they will
+        BOTH be refreshed.
+        ''',
+    )
+    p_refresh.add_argument(
+        '--lower',
+        dest='lower',
+        default=None,
+        help='''
+        The unix timestamp of the earliest items to refresh.
+        ''',
+    )
+    p_refresh.add_argument(
+        '--max_age',
+        '--max-age',
+        dest='max_age',
+        default=None,
+        help='''
+        Only refresh items that are at most this many seconds old.
+        ''',
+    )
+    p_refresh.add_argument(
+        '--min_age',
+        '--min-age',
+        dest='min_age',
+        default=None,
+        help='''
+        Only refresh items that are at least this many seconds old.
+        ''',
+    )
+    p_refresh.add_argument(
+        '-r',
+        '--subreddit',
+        dest='subreddit',
+        default=None,
+        help='''
+        The subreddit database to refresh.
+        ''',
+    )
+    p_refresh.add_argument(
+        '-s',
+        '--submissions',
+        dest='submissions',
+        action='store_true',
+        help='''
+        If provided, do refresh submissions. Otherwise don't.
+
+        If submissions and comments are BOTH left unspecified, then they will
+        BOTH be refreshed.
+        ''',
+    )
+    p_refresh.add_argument(
+        '-u',
+        '--user',
+        dest='username',
+        default=None,
+        help='''
+        The user database to refresh.
+        ''',
+    )
+    p_refresh.add_argument(
+        '--upper',
+        dest='upper',
+        default=None,
+        help='''
+        The unix timestamp at which to stop refreshing.
+        ''',
+    )
+    p_refresh.add_argument(
+        '--workers',
+        dest='workers',
+        default=1,
+        help='''
+        The number of /api/info requests to make at the same time. Each
+        worker logs in to reddit separately, but they share one ratelimit.
+        ''',
+    )
+    add_refresh_ttl_argument(p_refresh)
+    add_shared_ratelimit_arguments(p_refresh)
+    add_pragma_profile_argument(p_refresh)
+    p_refresh.set_defaults(func=refresh_gateway)
+
     # INDEX
     p_index = subparsers.add_parser(
         'index',
@@ -498,6 +870,17 @@ def main(argv):
         Perform an index sorted by title.
         ''',
     )
+    p_index.add_argument(
+        '--sort_indices',
+        '--sort-indices',
+        dest='sort_indices',
+        action='store_true',
+        help='''
+        Create database indices on author and score, so that these sorts are
+        faster the next time. The indices stay in the database and make new
+        inserts slightly slower.
+        ''',
+    )
     p_index.add_argument(
         '--offline',
         dest='offline',
@@ -520,6 +903,7 @@ def main(argv):
         Applies to ALL indexes!
         ''',
     )
+    add_pragma_profile_argument(p_index)
     p_index.set_defaults(func=index_gateway)
 
     # GET_SUBMISSIONS
@@ -579,6 +963,11 @@ def main(argv):
         from reddit.
         ''',
     )
+    add_concurrency_argument(p_get_submissions)
+    add_http_cache_arguments(p_get_submissions)
+    add_shared_ratelimit_arguments(p_get_submissions)
+    add_refresh_arguments(p_get_submissions)
+    add_pragma_profile_argument(p_get_submissions)
     p_get_submissions.set_defaults(func=get_submissions_gateway)
 
     try:
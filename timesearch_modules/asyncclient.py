@@ -0,0 +1,124 @@
+'''
+This module provides an asyncio layer over the blocking HTTP client used by
+timesearch, so that callers can keep many pushshift requests in flight at
+once. The concurrent pagination of pushshift.py is its only user; the reddit
+requests have their own worker threads in refresh and livestream.
+
+requests is a blocking library, so each call runs on one of the client's
+executor threads while the event loop awaits it. The requests Session
+gets a connection pool as large as the executor, so connections are reused
+instead of reopened. Every host has its own semaphore, which caps how many of
+the in-flight requests may go to that host at the same time.
+'''
+import asyncio
+import concurrent.futures
+import requests
+import urllib.parse
+
+from voussoirkit import vlogging
+
+log = vlogging.get_logger(__name__)
+
+class AsyncRatelimiter:
+    '''
+    Wraps a voussoirkit Ratelimiter so that coroutines can wait on it without
+    blocking the event loop. The wrapped limit runs on an executor thread, so
+    blocking and async callers spend from the same allowance, and ratelimiters
+    that do their own blocking work, like the SharedRatelimiter's file, don't
+    stall the loop either.
+    '''
+    def __init__(self, ratelimiter, executor=None):
+        self.ratelimiter = ratelimiter
+        self.executor = executor
+
+    async def limit(self, cost=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.ratelimiter.limit, cost)
+
+    def observe(self, response):
+        # Only the adaptive ratelimiters learn from responses.
+        observe = getattr(self.ratelimiter, 'observe', None)
+        if observe is not None:
+            observe(response)
+
+class AsyncClient:
+    def __init__(
+            self,
+            *,
+            headers=None,
+            host_limits=None,
+            max_connections=16,
+            per_host=8,
+            ratelimit=None,
+        ):
+        '''
+        headers:
+            Added to every request made with get.
+
+        host_limits:
+            A dict of {host: n} overriding per_host for specific hosts.
+
+        max_connections:
+            The number of threads, and the size of the connection pool. This
+            is the most requests that can be in flight across all hosts.
+
+        per_host:
+            The most requests that can be in flight to any one host.
+
+        ratelimit:
+            An AsyncRatelimiter, awaited before every request made with get.
+        '''
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_connections)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=max_connections,
+            pool_maxsize=max_connections,
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+        self.host_limits = host_limits or {}
+        self.per_host = per_host
+        self.ratelimit = ratelimit
+        self._semaphores = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def _semaphore(self, host):
+        # Semaphores belong to the event loop they were first used in, so
+        # each loop gets its own set.
+        key = (asyncio.get_running_loop(), host)
+        semaphore = self._semaphores.get(key, None)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.host_limits.get(host, self.per_host))
+            self._semaphores[key] = semaphore
+        return semaphore
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+    async def get(self, url, params=None):
+        '''
+        Return the requests.Response for this url. HTTP errors are raised.
+        '''
+        host = urllib.parse.urlsplit(url).netloc
+        async with self._semaphore(host):
+            if self.ratelimit is not None:
+                await self.ratelimit.limit()
+            log.debug('Requesting %s with %s', url, params)
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(
+                self.executor,
+                lambda: self.session.get(url, params=params),
+            )
+        if self.ratelimit is not None:
+            self.ratelimit.observe(response)
+        response.raise_for_status()
+        return response
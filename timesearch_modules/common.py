@@ -1,9 +1,14 @@
 import datetime
 import logging
 import os
+import queue
+import threading
 import time
 import traceback
 
+from . import ratelimits
+
+from voussoirkit import backoff
 from voussoirkit import vlogging
 
 VERSION = '2020.09.06.0'
@@ -36,6 +41,14 @@ log = vlogging.get_logger(__name__)
 
 r = bot.anonymous()
 
+# Set by pushshift.use_shared_ratelimit so that our reddit requests count
+# against the budget shared with the other timesearch processes. PRAW still
+# applies its own ratelimit on top of this.
+reddit_ratelimit = None
+
+# Holds the Reddit instance of each worker thread, see thread_reddit.
+_thread_local = threading.local()
+
 def assert_file_exists(filepath):
     if not os.path.exists(filepath):
         raise FileNotFoundError(filepath)
@@ -107,6 +120,13 @@ def is_xor(*args):
     '''
     return [bool(a) for a in args].count(True) == 1
 
+def limit_reddit():
+    '''
+    Call this before making a request to reddit through PRAW.
+    '''
+    if reddit_ratelimit is not None:
+        reddit_ratelimit.limit()
+
 def login():
     global r
     log.debug('Logging in to reddit.')
@@ -118,18 +138,26 @@ def nofailrequest(function):
     This function accepts 1 parameter, a function, and returns a modified
     version of that function that will try-catch, sleep, and loop until it
     finally returns.
+
+    The sleeps back off exponentially with jitter, or follow the Retry-After
+    header if the exception carries a response that has one.
     '''
     def a(*args, **kwargs):
+        bo = backoff.Exponential(a=2, b=1, max=300)
         while True:
             try:
                 result = function(*args, **kwargs)
                 return result
             except KeyboardInterrupt:
                 raise
-            except Exception:
+            except Exception as exc:
                 traceback.print_exc()
-                print('Retrying in 2...')
-                time.sleep(2)
+                delay = ratelimits.jitter(bo.next())
+                requested = ratelimits.retry_after(getattr(exc, 'response', None))
+                if requested is not None:
+                    delay = max(delay, requested)
+                print(f'Retrying in {delay:.1f}...')
+                time.sleep(delay)
     return a
 
 def split_any(text, delimiters):
@@ -148,3 +176,69 @@ def t3_prefix(submission_id):
     if not submission_id.startswith('t3_'):
         submission_id = 't3_' + submission_id
     return submission_id
+
+def thread_reddit():
+    '''
+    PRAW is not thread safe, so each worker thread gets its own Reddit
+    instance, logged in the same way as r. The main thread uses r itself.
+    '''
+    if threading.current_thread() is threading.main_thread():
+        return r
+
+    reddit = getattr(_thread_local, 'r', None)
+    if reddit is None:
+        log.debug('Logging in to reddit for %s.', threading.current_thread().name)
+        reddit = bot.login(bot.anonymous())
+        _thread_local.r = reddit
+    return reddit
+
+def threaded_generator(generator, buffer_size):
+    '''
+    Run the generator on a background thread and yield its items from a queue
+    of at most buffer_size, so that producing the next items overlaps with
+    whatever the caller does with the current ones. When the queue is full the
+    producer waits, which keeps memory bounded. Exceptions from the generator
+    are raised here.
+    '''
+    items = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in generator:
+                if not put((item, None)):
+                    return
+        except BaseException as exc:
+            put((done, exc))
+        else:
+            put((done, None))
+        finally:
+            # Run the generator's cleanup on this thread, now, rather than
+            # whenever it gets garbage collected.
+            close = getattr(generator, 'close', None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            (item, exc) = items.get()
+            if item is done:
+                if exc is not None:
+                    raise exc
+                return
+            yield item
+    finally:
+        # If the caller abandons us early, let the producer thread finish.
+        stop.set()
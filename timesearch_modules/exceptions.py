@@ -19,6 +19,13 @@ OUTOFDATE = '''
 Database is out of date. {current} should be {new}.
 Please run utilities\\database_upgrader.py "{filepath.absolute_path}"
 '''.strip()
+class CacheMiss(TimesearchException):
+    '''
+    Raised by the replay-only httpcache.ResponseCache for requests it has no
+    response for.
+    '''
+    error_message = 'The replay-only cache has no response for {} with {}.'
+
 class DatabaseOutOfDate(TimesearchException):
     '''
     Raised by TSDB __init__ if the user's database is behind.
@@ -28,8 +35,17 @@ class DatabaseOutOfDate(TimesearchException):
 class DatabaseNotFound(TimesearchException, FileNotFoundError):
     error_message = 'Database file not found: "{}"'
 
+class InvalidLivestreamConfig(TimesearchException):
+    '''
+    Raised by livestream.load_config for config files it can't understand.
+    '''
+    error_message = 'Invalid livestream config "{}": {}'
+
 class NotExclusive(TimesearchException):
     '''
     For when two or more mutually exclusive actions have been requested.
     '''
     error_message = 'One and only one of {} must be passed.'
+
+class UnknownPragmaProfile(TimesearchException):
+    error_message = 'Unknown pragma profile "{}". Choose from {}.'
@@ -12,6 +12,10 @@ def get_comments(
         do_supplement=True,
         lower=None,
         upper=None,
+        pragma_profile=None,
+        concurrency=None,
+        refresh_ttl=None,
+        refresh_max_age=None,
     ):
     if not specific_submission and not common.is_xor(subreddit, username):
         raise exceptions.NotExclusive(['subreddit', 'username'])
@@ -21,22 +25,27 @@ def get_comments(
     common.login()
 
     if specific_submission:
-        (database, subreddit) = tsdb.TSDB.for_submission(specific_submission, do_create=True, fix_name=True)
+        (database, subreddit) = tsdb.TSDB.for_submission(specific_submission, do_create=True, fix_name=True, pragma_profile=pragma_profile)
         specific_submission = common.t3_prefix(specific_submission)[3:]
         specific_submission = common.r.submission(specific_submission)
         database.insert(specific_submission)
 
     elif subreddit:
-        (database, subreddit) = tsdb.TSDB.for_subreddit(subreddit, do_create=True, fix_name=True)
+        (database, subreddit) = tsdb.TSDB.for_subreddit(subreddit, do_create=True, fix_name=True, pragma_profile=pragma_profile)
 
     else:
-        (database, username) = tsdb.TSDB.for_user(username, do_create=True, fix_name=True)
+        (database, username) = tsdb.TSDB.for_user(username, do_create=True, fix_name=True, pragma_profile=pragma_profile)
 
     cur = database.sql.cursor()
 
     if lower is None:
         lower = 0
-    if lower == 'update':
+    synced = database.get_sync_state('pushshift', 'comments')
+    if lower == 'update' and not specific_submission and synced is not None:
+        lower = synced - 1
+    if lower == 'update' and not specific_submission:
+        # This database has not recorded its sync_state yet, so we have to
+        # find the latest comment the hard way.
         query_latest = 'SELECT created FROM comments ORDER BY created DESC LIMIT 1'
         if subreddit:
             # Instead of blindly taking the highest timestamp currently in the db,
@@ -66,20 +75,51 @@ def get_comments(
     if lower == 'update':
         lower = 0
 
+    # Only a general scan that picks up where the last one ended can advance
+    # the sync_state, otherwise we'd be claiming to have everything in between.
+    do_sync_state = not specific_submission and (synced is None or int(lower) < synced)
+
     if specific_submission:
         comments = pushshift.get_comments_from_submission(specific_submission)
     elif subreddit:
-        comments = pushshift.get_comments_from_subreddit(subreddit, lower=lower, upper=upper)
+        comments = pushshift.get_comments_from_subreddit(
+            subreddit,
+            lower=lower,
+            upper=upper,
+            concurrency=concurrency,
+        )
     elif username:
-        comments = pushshift.get_comments_from_user(username, lower=lower, upper=upper)
+        comments = pushshift.get_comments_from_user(
+            username,
+            lower=lower,
+            upper=upper,
+            concurrency=concurrency,
+        )
 
     if do_supplement:
-        comments = pushshift.supplement_reddit_data(comments, chunk_size=100)
+        if refresh_ttl is None and refresh_max_age is None:
+            skip = None
+        else:
+            skip = lambda fullnames: database.get_fresh_fullnames(
+                fullnames,
+                ttl=refresh_ttl,
+                max_age=refresh_max_age,
+            )
+        comments = pushshift.supplement_reddit_data(
+            comments,
+            chunk_size=100,
+            pipelined=True,
+            skip=skip,
+        )
     comments = common.generator_chunker(comments, 500)
 
     form = '{lower} ({lower_unix}) - {upper} ({upper_unix}) +{gain}'
     for chunk in comments:
-        step = database.insert(chunk)
+        step = database.insert(chunk, commit=False)
+        if do_sync_state:
+            latest = max(item.created_utc for item in chunk)
+            database.set_sync_state('pushshift', 'comments', latest)
+        database.sql.commit()
         message = form.format(
             lower=common.human(chunk[0].created_utc),
             upper=common.human(chunk[-1].created_utc),
@@ -100,6 +140,9 @@ def get_comments(
         database.sql.commit()
 
 def get_comments_argparse(args):
+    pushshift.use_http_cache_argparse(args)
+    pushshift.use_shared_ratelimit_argparse(args)
+
     return get_comments(
         subreddit=args.subreddit,
         username=args.username,
@@ -110,4 +153,8 @@ def get_comments_argparse(args):
         do_supplement=args.do_supplement,
         lower=args.lower,
         upper=args.upper,
+        pragma_profile=args.pragma_profile,
+        concurrency=common.int_none(args.concurrency),
+        refresh_ttl=common.int_none(args.refresh_ttl),
+        refresh_max_age=common.int_none(args.refresh_max_age),
     )
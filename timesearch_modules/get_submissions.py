@@ -30,6 +30,10 @@ def get_submissions(
         lower=None,
         upper=None,
         do_supplement=True,
+        pragma_profile=None,
+        concurrency=None,
+        refresh_ttl=None,
+        refresh_max_age=None,
     ):
     '''
     Collect submissions across time.
@@ -41,16 +45,20 @@ def get_submissions(
     common.login()
 
     if subreddit:
-        (database, subreddit) = tsdb.TSDB.for_subreddit(subreddit, fix_name=True)
+        (database, subreddit) = tsdb.TSDB.for_subreddit(subreddit, fix_name=True, pragma_profile=pragma_profile)
     elif username:
-        (database, username) = tsdb.TSDB.for_user(username, fix_name=True)
+        (database, username) = tsdb.TSDB.for_user(username, fix_name=True, pragma_profile=pragma_profile)
     cur = database.sql.cursor()
 
     subreddit = _normalize_subreddit(subreddit)
     user = _normalize_user(username)
 
-    if lower == 'update':
-        # Start from the latest submission
+    synced = database.get_sync_state('pushshift', 'submissions')
+    if lower == 'update' and synced is not None:
+        lower = synced
+    elif lower == 'update':
+        # This database has not recorded its sync_state yet, so start from
+        # the latest submission.
         cur.execute('SELECT created FROM submissions ORDER BY created DESC LIMIT 1')
         fetch = cur.fetchone()
         if fetch is not None:
@@ -60,19 +68,49 @@ def get_submissions(
     if lower is None:
         lower = 0
 
+    # Only a scan that picks up where the last one ended can advance the
+    # sync_state, otherwise we'd be claiming to have everything in between.
+    do_sync_state = synced is None or lower <= synced
+
     if username:
-        submissions = pushshift.get_submissions_from_user(username, lower=lower, upper=upper)
+        submissions = pushshift.get_submissions_from_user(
+            username,
+            lower=lower,
+            upper=upper,
+            concurrency=concurrency,
+        )
     else:
-        submissions = pushshift.get_submissions_from_subreddit(subreddit, lower=lower, upper=upper)
+        submissions = pushshift.get_submissions_from_subreddit(
+            subreddit,
+            lower=lower,
+            upper=upper,
+            concurrency=concurrency,
+        )
 
     if do_supplement:
-        submissions = pushshift.supplement_reddit_data(submissions, chunk_size=100)
+        if refresh_ttl is None and refresh_max_age is None:
+            skip = None
+        else:
+            skip = lambda fullnames: database.get_fresh_fullnames(
+                fullnames,
+                ttl=refresh_ttl,
+                max_age=refresh_max_age,
+            )
+        submissions = pushshift.supplement_reddit_data(
+            submissions,
+            chunk_size=100,
+            pipelined=True,
+            skip=skip,
+        )
     submissions = common.generator_chunker(submissions, 200)
 
     form = '{lower} ({lower_unix}) - {upper} ({upper_unix}) +{gain}'
     for chunk in submissions:
         chunk.sort(key=lambda x: x.created_utc)
-        step = database.insert(chunk)
+        step = database.insert(chunk, commit=False)
+        if do_sync_state:
+            database.set_sync_state('pushshift', 'submissions', chunk[-1].created_utc)
+        database.sql.commit()
         message = form.format(
             lower=common.human(chunk[0].created_utc),
             upper=common.human(chunk[-1].created_utc),
@@ -88,6 +126,9 @@ def get_submissions(
     print('Ended with %d items in %s' % (itemcount, database.filepath.basename))
 
 def get_submissions_argparse(args):
+    pushshift.use_http_cache_argparse(args)
+    pushshift.use_shared_ratelimit_argparse(args)
+
     if args.lower == 'update':
         lower = 'update'
     else:
@@ -99,4 +140,8 @@ def get_submissions_argparse(args):
         lower=lower,
         upper=common.int_none(args.upper),
         do_supplement=args.do_supplement,
+        pragma_profile=args.pragma_profile,
+        concurrency=common.int_none(args.concurrency),
+        refresh_ttl=common.int_none(args.refresh_ttl),
+        refresh_max_age=common.int_none(args.refresh_max_age),
     )
@@ -0,0 +1,258 @@
+'''
+An on-disk cache of HTTP response bodies, so that a scan which is retried or
+re-run after a crash does not need to download the same pages again.
+
+The bodies are stored content-addressed, named by the sha256 of their bytes,
+so identical responses (like the many empty pages at the end of a scan) are
+only stored once. A small SQLite index maps each request, identified by its
+url and sorted params, to the body it received and when.
+
+Only the search pages that had already settled when we fetched them are kept
+for long: the ones whose window had closed, and the full pages whose items are
+all old. The last page of a scan, which gets new items as they are posted, is
+never served from the cache to a live scan.
+
+When the bodies take up more than max_size bytes, the least recently used
+requests are forgotten until they fit again.
+'''
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from . import exceptions
+
+from voussoirkit import pathclass
+from voussoirkit import vlogging
+
+log = vlogging.get_logger(__name__)
+
+DAY = 24 * 60 * 60
+
+# Seconds that a cached response stays valid, chosen by the longest of these
+# that appears in the url. The pushshift search pages for a closed time range
+# don't change, so they can be kept for a long time.
+DEFAULT_TTLS = {
+    '': 1 * DAY,
+    '/reddit/submission/search': 30 * DAY,
+    '/reddit/comment/search': 30 * DAY,
+}
+
+# The urls whose pages cover the time window between their `after` and
+# `before` params, oldest first. They only get their long ttl if they had
+# settled when they were fetched, see is_settled, because pushshift may still
+# be adding items to a recent window. Other pages of these urls expire
+# immediately.
+WINDOWED_URLS = ['/reddit/submission/search', '/reddit/comment/search']
+SETTLE_TIME = 1 * DAY
+OPEN_WINDOW_TTL = 0
+
+DEFAULT_MAX_SIZE = 2 * 2**30
+
+INDEX_INIT = '''
+CREATE TABLE IF NOT EXISTS responses(
+    request_hash TEXT PRIMARY KEY,
+    url TEXT,
+    content_hash TEXT,
+    size INT,
+    fetched_at INT,
+    used_at INT,
+    settled INT
+);
+CREATE INDEX IF NOT EXISTS responses_content_index ON responses(content_hash);
+CREATE INDEX IF NOT EXISTS responses_used_index ON responses(used_at);
+'''
+
+def is_settled(url, params, body, fetched_at):
+    '''
+    Return True if this response, fetched at the unix timestamp fetched_at,
+    won't change anymore as far as the ttls are concerned.
+
+    A search page has settled if its `before` was at least SETTLE_TIME in the
+    past, or if it is full and its newest item is that old. Since the pages
+    are sorted oldest first, newer items can only land on later pages. A page
+    that isn't full may be the last one, which will grow.
+    '''
+    if not any(windowed in url for windowed in WINDOWED_URLS):
+        return True
+
+    params = params or {}
+    settle_line = fetched_at - SETTLE_TIME
+    try:
+        before = params.get('before', None)
+        if before is not None and int(before) <= settle_line:
+            return True
+
+        data = json.loads(body)['data']
+        size = int(params['size'])
+        createds = [item['created_utc'] for item in data]
+    except (KeyError, TypeError, ValueError):
+        return False
+    return len(createds) >= size > 0 and max(createds) <= settle_line
+
+def request_hash(url, params):
+    params = sorted((str(key), str(value)) for (key, value) in (params or {}).items())
+    identity = json.dumps([url, params])
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    def __init__(self, directory, *, max_size=DEFAULT_MAX_SIZE, replay_only=False, ttls=None):
+        '''
+        max_size:
+            The most bytes of response bodies to keep, or None for no limit.
+
+        replay_only:
+            If True, the caller should never touch the network. A request that
+            is not in the cache raises exceptions.CacheMiss. Expired responses
+            are still replayed, because an old response is better than nothing
+            at all.
+
+        ttls:
+            A dict of {url substring: seconds} which is added on top of
+            DEFAULT_TTLS.
+        '''
+        self.directory = pathclass.Path(directory)
+        self.directory.makedirs(exist_ok=True)
+        self.max_size = max_size
+        self.replay_only = replay_only
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+
+        self.lock = threading.Lock()
+        index_path = self.directory.with_child('index.db')
+        self.sql = sqlite3.connect(index_path.absolute_path, check_same_thread=False)
+        self.sql.executescript(INDEX_INIT)
+        columns = [row[1] for row in self.sql.execute('PRAGMA table_info(responses)')]
+        if 'settled' not in columns:
+            # Caches from before is_settled. Their responses count as open.
+            self.sql.execute('ALTER TABLE responses ADD COLUMN settled INT')
+        # The cap may have been lowered since last time.
+        self._evict(self.sql.cursor())
+        self.sql.commit()
+
+    def __repr__(self):
+        return f'ResponseCache({self.directory.absolute_path})'
+
+    def _body_path(self, content_hash):
+        return self.directory.with_child(content_hash[:2]).with_child(content_hash)
+
+    def _forget(self, cur, request_hashes):
+        for request in request_hashes:
+            cur.execute('SELECT content_hash FROM responses WHERE request_hash == ?', [request])
+            (content_hash,) = cur.fetchone()
+            cur.execute('DELETE FROM responses WHERE request_hash == ?', [request])
+            cur.execute('SELECT 1 FROM responses WHERE content_hash == ? LIMIT 1', [content_hash])
+            if cur.fetchone() is None:
+                body_path = self._body_path(content_hash)
+                if body_path.exists:
+                    os.remove(body_path)
+
+    def _evict(self, cur):
+        if self.max_size is None:
+            return
+
+        cur.execute('SELECT SUM(size) FROM (SELECT DISTINCT content_hash, size FROM responses)')
+        total = cur.fetchone()[0] or 0
+        if total <= self.max_size:
+            return
+
+        # Evict a little extra so that we aren't doing this on every put.
+        target = self.max_size * 0.9
+        evict = []
+        cur.execute('SELECT request_hash, size FROM responses ORDER BY used_at ASC')
+        for (request, size) in cur.fetchall():
+            if total <= target:
+                break
+            evict.append(request)
+            total -= size
+        log.debug('Evicting %d responses from %s.', len(evict), self)
+        self._forget(cur, evict)
+
+    def ttl(self, url, settled=True):
+        '''
+        Return the number of seconds that a response from this url stays
+        valid. settled is the result of is_settled for that response.
+        '''
+        if not settled:
+            return OPEN_WINDOW_TTL
+
+        matches = [key for key in self.ttls if key in url]
+        return self.ttls[max(matches, key=len)]
+
+    def get(self, url, params=None):
+        '''
+        Return the cached body of this request as bytes, or None if it is not
+        cached or has expired.
+        '''
+        request = request_hash(url, params)
+        now = time.time()
+        with self.lock:
+            cur = self.sql.cursor()
+            cur.execute('SELECT content_hash, fetched_at, settled FROM responses WHERE request_hash == ?', [request])
+            fetch = cur.fetchone()
+            if fetch is None:
+                if self.replay_only:
+                    raise exceptions.CacheMiss(url, params)
+                return None
+
+            (content_hash, fetched_at, settled) = fetch
+            expired = now - fetched_at >= self.ttl(url, bool(settled))
+            if expired and not self.replay_only:
+                return None
+
+            body_path = self._body_path(content_hash)
+            if not body_path.exists:
+                self._forget(cur, [request])
+                self.sql.commit()
+                if self.replay_only:
+                    raise exceptions.CacheMiss(url, params)
+                return None
+
+            cur.execute('UPDATE responses SET used_at = ? WHERE request_hash == ?', [now, request])
+            self.sql.commit()
+
+            # Read while holding the lock, so a put on another thread can't
+            # evict the body in the meantime.
+            log.debug('Cache hit for %s with %s', url, params)
+            with body_path.open('rb') as handle:
+                return handle.read()
+
+    def put(self, url, params, body):
+        content_hash = hashlib.sha256(body).hexdigest()
+        body_path = self._body_path(content_hash)
+        if not body_path.exists:
+            body_path.parent.makedirs(exist_ok=True)
+            # Write to a temporary name first so that a crash can't leave a
+            # truncated body under the real name.
+            temp_path = body_path.parent.with_child(content_hash + '.tmp')
+            with temp_path.open('wb') as handle:
+                handle.write(body)
+            os.replace(temp_path, body_path)
+
+        request = request_hash(url, params)
+        now = time.time()
+        query = '''
+            INSERT INTO responses VALUES(?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(request_hash) DO UPDATE SET
+            content_hash = excluded.content_hash,
+            size = excluded.size,
+            fetched_at = excluded.fetched_at,
+            used_at = excluded.used_at,
+            settled = excluded.settled
+        '''
+        settled = is_settled(url, params, body, now)
+        with self.lock:
+            cur = self.sql.cursor()
+            cur.execute('SELECT content_hash FROM responses WHERE request_hash == ?', [request])
+            previous = cur.fetchone()
+            bindings = [request, url, content_hash, len(body), now, now, settled]
+            cur.execute(query, bindings)
+            if previous is not None and previous[0] != content_hash:
+                cur.execute('SELECT 1 FROM responses WHERE content_hash == ? LIMIT 1', [previous[0]])
+                if cur.fetchone() is None:
+                    old_path = self._body_path(previous[0])
+                    if old_path.exists:
+                        os.remove(old_path)
+            self._evict(cur)
+            self.sql.commit()
@@ -53,14 +53,19 @@ def index(
         html=False,
         offline=False,
         score_threshold=0,
+        pragma_profile=None,
+        sort_indices=False,
     ):
     if not common.is_xor(subreddit, username):
         raise exceptions.NotExclusive(['subreddit', 'username'])
 
     if subreddit:
-        database = tsdb.TSDB.for_subreddit(subreddit, do_create=False)
+        database = tsdb.TSDB.for_subreddit(subreddit, do_create=False, pragma_profile=pragma_profile)
     else:
-        database = tsdb.TSDB.for_user(username, do_create=False)
+        database = tsdb.TSDB.for_user(username, do_create=False, pragma_profile=pragma_profile)
+
+    if sort_indices:
+        database.create_optional_indices()
 
     kwargs = {'html': html, 'offline': offline, 'score_threshold': score_threshold}
     wrote = None
@@ -182,4 +187,6 @@ def index_argparse(args):
         html=args.html,
         offline=args.offline,
         score_threshold=common.int_none(args.score_threshold),
+        pragma_profile=args.pragma_profile,
+        sort_indices=args.sort_indices,
     )
@@ -1,60 +1,192 @@
+import collections
+import functools
+import gzip
+import hashlib
+import io
 import json
+import lzma
+import multiprocessing
 import time
 import traceback
 
 from voussoirkit import pathclass
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 from . import common
 from . import exceptions
+from . import jsonrows
 from . import pushshift
 from . import tsdb
 
-def is_submission(obj):
-    return (
-        obj.get('name', '').startswith('t3_')
-        or obj.get('over_18') is not None
-    )
+# The pushshift archives are compressed with long-distance matching, which
+# needs a bigger window than zstandard allows by default.
+ZSTD_MAX_WINDOW_SIZE = 2 ** 31
 
-def is_comment(obj):
-    return (
-        obj.get('name', '').startswith('t1_')
-        or obj.get('parent_id', '').startswith('t3_')
-        or obj.get('link_id', '').startswith('t3_')
-    )
+# The lines are converted into rows in blocks of this size, which is also the
+# unit of work for the worker processes in parallel mode. We commit and save a
+# checkpoint after at least this many rows.
+LINES_PER_BLOCK = 5000
+ROWS_PER_COMMIT = 100000
 
-def jsonfile_to_objects(filepath):
+def file_identity(filepath):
+    '''
+    Return a string that identifies this input file across runs, even if it
+    has been moved or renamed, so that we know which checkpoint belongs to it.
+    '''
+    with filepath.open('rb') as handle:
+        head = handle.read(2 ** 20)
+    return f'{filepath.size}-{hashlib.sha1(head).hexdigest()}'
+
+def open_jsonfile(filepath):
+    '''
+    Return a binary handle for the file, decompressing .zst, .gz, and .xz
+    files on the fly so that they never need to be extracted to disk.
+    '''
+    extension = filepath.extension.ext.lower()
+    if extension == 'zst':
+        if zstandard is None:
+            raise ImportError('Reading .zst files requires the zstandard module')
+        decompressor = zstandard.ZstdDecompressor(max_window_size=ZSTD_MAX_WINDOW_SIZE)
+        handle = decompressor.stream_reader(filepath.open('rb'), closefd=True)
+        return io.BufferedReader(handle)
+    if extension == 'gz':
+        return gzip.open(filepath.absolute_path, 'rb')
+    if extension == 'xz':
+        return lzma.open(filepath.absolute_path, 'rb')
+    return filepath.open('rb')
+
+def _skip_to(handle, offset):
+    '''
+    Move the handle forward to this offset of the uncompressed data.
+
+    The pushshift archives are a single compressed frame, so there are no
+    frame boundaries to jump to. Instead we decompress and throw away
+    everything before the offset, which is still much faster than parsing
+    and inserting it all again.
+    '''
+    if handle.seekable():
+        handle.seek(offset)
+        return
+
+    remaining = offset
+    while remaining > 0:
+        chunk = handle.read(min(remaining, 2 ** 24))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+
+def jsonfile_to_lines(filepath, offset=0):
+    '''
+    Yield (line, end_offset) for each line of the file, starting at the given
+    offset of the uncompressed data. end_offset is the position just after
+    the line, so it can be saved as a checkpoint to resume from.
+    '''
     filepath = pathclass.Path(filepath)
     filepath.assert_is_file()
 
-    with filepath.open('r', encoding='utf-8') as handle:
+    with open_jsonfile(filepath) as handle:
+        if offset:
+            _skip_to(handle, offset)
         for line in handle:
+            offset += len(line)
             line = line.strip()
             if not line:
                 break
-            obj = json.loads(line)
-            if is_submission(obj):
-                yield pushshift.DummySubmission(**obj)
-            elif is_comment(obj):
-                yield pushshift.DummyComment(**obj)
-            else:
-                raise ValueError(f'Could not recognize object type {obj}.')
+            yield (line, offset)
+
+def jsonfile_to_objects(filepath):
+    for (line, offset) in jsonfile_to_lines(filepath):
+        obj = json.loads(line)
+        if jsonrows.is_submission(obj):
+            yield pushshift.DummySubmission(**obj)
+        elif jsonrows.is_comment(obj):
+            yield pushshift.DummyComment(**obj)
+        else:
+            raise ValueError(f'Could not recognize object type {obj}.')
+
+def jsonfile_to_row_blocks(filepath, offset=0, workers=None, converter=jsonrows.rows_from_lines):
+    '''
+    Yield (rows, end_offset) for each block of LINES_PER_BLOCK lines, where
+    rows are (table, row, edited) tuples for TSDB.insert_rows. This skips the
+    DummyObjects that jsonfile_to_objects would build, which saves a lot of
+    time and allocations when ingesting big archives.
+
+    converter is the function that turns a block of lines into rows. It must
+    be picklable if you use workers.
+
+    If workers is more than 1, a pool of worker processes does the JSON
+    parsing. The blocks still come out in file order, and only a few blocks
+    per worker are in flight at once, so if the database can't keep up we stop
+    reading the file instead of filling up memory.
+    '''
+    lines = jsonfile_to_lines(filepath, offset=offset)
+    blocks = common.generator_chunker(lines, LINES_PER_BLOCK)
+    blocks = (([line for (line, end) in block], block[-1][1]) for block in blocks)
+
+    if workers is None or workers <= 1:
+        for (block, end) in blocks:
+            yield (converter(block), end)
+        return
+
+    in_flight = collections.deque()
+    with multiprocessing.Pool(workers) as pool:
+        for (block, end) in blocks:
+            in_flight.append((pool.apply_async(converter, [block]), end))
+            if len(in_flight) >= workers * 2:
+                (result, end) = in_flight.popleft()
+                yield (result.get(), end)
+        while in_flight:
+            (result, end) = in_flight.popleft()
+            yield (result.get(), end)
 
 def ingest_jsonfile(
         filepath,
         subreddit=None,
         username=None,
+        pragma_profile=None,
+        workers=None,
+        restart=False,
     ):
+    '''
+    Every ROWS_PER_COMMIT rows, the database records how far into the file we
+    have committed. If the ingest is interrupted, running it again with the
+    same file will pick up from there, unless restart is True.
+    '''
     if not common.is_xor(subreddit, username):
         raise exceptions.NotExclusive(['subreddit', 'username'])
 
     if subreddit:
-        (database, subreddit) = tsdb.TSDB.for_subreddit(subreddit, fix_name=True)
+        (database, subreddit) = tsdb.TSDB.for_subreddit(subreddit, fix_name=True, pragma_profile=pragma_profile)
     elif username:
-        (database, username) = tsdb.TSDB.for_user(username, fix_name=True)
+        (database, username) = tsdb.TSDB.for_user(username, fix_name=True, pragma_profile=pragma_profile)
     cur = database.sql.cursor()
 
-    objects = jsonfile_to_objects(filepath)
-    database.insert(objects)
+    filepath = pathclass.Path(filepath)
+    filepath.assert_is_file()
+    file_id = file_identity(filepath)
+
+    offset = None if restart else database.get_ingest_checkpoint(file_id)
+    if offset is None:
+        offset = 0
+    else:
+        print(f'Resuming {filepath.basename} from byte {offset}.')
+
+    blocks = jsonfile_to_row_blocks(filepath, offset=offset, workers=workers)
+    pending = 0
+    for (rows, offset) in blocks:
+        database.insert_rows(rows, commit=False)
+        pending += len(rows)
+        if pending >= ROWS_PER_COMMIT:
+            database.set_ingest_checkpoint(file_id, filepath, offset)
+            database.sql.commit()
+            pending = 0
+
+    database.set_ingest_checkpoint(file_id, filepath, offset)
+    database.sql.commit()
 
     cur.execute('SELECT COUNT(idint) FROM submissions')
     submissioncount = cur.fetchone()[0]
@@ -63,9 +195,129 @@ def ingest_jsonfile(
 
     print('Ended with %d submissions and %d comments in %s' % (submissioncount, commentcount, database.filepath.basename))
 
+def ingest_jsonfile_routed(
+        filepath,
+        subreddits=None,
+        usernames=None,
+        pragma_profile=None,
+        workers=None,
+        restart=False,
+    ):
+    '''
+    Read a combined dump like the monthly RC_ and RS_ files once, and insert
+    each item into the database of its subreddit and/or author, if they are
+    among the given subreddits and usernames. Everything else is skipped,
+    mostly without being parsed.
+
+    Each database keeps its own checkpoint, and we resume from the earliest
+    of them, so adding a new name to the list means the file gets read from
+    the start again.
+    '''
+    subreddits = subreddits or []
+    usernames = usernames or []
+    if not subreddits and not usernames:
+        raise TypeError('Required subreddits and/or usernames parameter')
+
+    # The names may be database paths, so route by the name that each
+    # database resolves to rather than by the string we were given.
+    databases = {}
+    for subreddit in subreddits:
+        (database, subreddit) = tsdb.TSDB.for_subreddit(subreddit, fix_name=True, pragma_profile=pragma_profile)
+        databases[('subreddit', subreddit.lower())] = database
+    for username in usernames:
+        (database, username) = tsdb.TSDB.for_user(username, fix_name=True, pragma_profile=pragma_profile)
+        databases[('user', username.lower())] = database
+
+    filepath = pathclass.Path(filepath)
+    filepath.assert_is_file()
+    file_id = file_identity(filepath)
+
+    if restart:
+        offset = 0
+    else:
+        offsets = [database.get_ingest_checkpoint(file_id) for database in databases.values()]
+        offset = min(offset or 0 for offset in offsets)
+    if offset:
+        print(f'Resuming {filepath.basename} from byte {offset}.')
+
+    converter = functools.partial(
+        jsonrows.routed_rows_from_lines,
+        subreddits=set(name for (kind, name) in databases if kind == 'subreddit'),
+        authors=set(name for (kind, name) in databases if kind == 'user'),
+    )
+    blocks = jsonfile_to_row_blocks(filepath, offset=offset, workers=workers, converter=converter)
+
+    def checkpoint(offset):
+        for database in databases.values():
+            database.set_ingest_checkpoint(file_id, filepath, offset)
+            database.sql.commit()
+
+    pending = 0
+    for (results, offset) in blocks:
+        batches = {}
+        for (destinations, row) in results:
+            for destination in destinations:
+                batches.setdefault(destination, []).append(row)
+
+        for (destination, rows) in batches.items():
+            databases[destination].insert_rows(rows, commit=False)
+            pending += len(rows)
+
+        if pending >= ROWS_PER_COMMIT:
+            checkpoint(offset)
+            pending = 0
+
+    checkpoint(offset)
+
+    for database in databases.values():
+        cur = database.sql.cursor()
+        cur.execute('SELECT COUNT(idint) FROM submissions')
+        submissioncount = cur.fetchone()[0]
+        cur.execute('SELECT COUNT(idint) FROM comments')
+        commentcount = cur.fetchone()[0]
+        print('Ended with %d submissions and %d comments in %s' % (submissioncount, commentcount, database.filepath.basename))
+
+def _read_watch_file(watch_file):
+    '''
+    Return (subreddits, usernames) from a file with one name per line, where
+    usernames start with @ like their database filenames do.
+    '''
+    subreddits = []
+    usernames = []
+    watch_file = pathclass.Path(watch_file)
+    for line in watch_file.readlines('r', encoding='utf-8'):
+        line = line.split('#')[0].strip()
+        if not line:
+            continue
+        if line.startswith('@'):
+            usernames.append(line[1:])
+        else:
+            subreddits.append(line)
+    return (subreddits, usernames)
+
 def ingest_jsonfile_argparse(args):
+    if args.route or args.watch_file:
+        subreddits = common.split_any(args.subreddit, ['+', ' ', ',']) if args.subreddit else []
+        usernames = common.split_any(args.username, ['+', ' ', ',']) if args.username else []
+        if args.watch_file:
+            (more_subreddits, more_usernames) = _read_watch_file(args.watch_file)
+            subreddits.extend(more_subreddits)
+            usernames.extend(more_usernames)
+
+        return ingest_jsonfile_routed(
+            filepath=args.json_file,
+            subreddits=subreddits,
+            usernames=usernames,
+            pragma_profile=args.pragma_profile,
+            workers=args.workers,
+            restart=args.restart,
+        )
+
     return ingest_jsonfile(
         subreddit=args.subreddit,
         username=args.username,
         filepath=args.json_file,
+        pragma_profile=args.pragma_profile,
+        workers=args.workers,
+        restart=args.restart,
     )
@@ -0,0 +1,172 @@
+'''
+This module converts the JSON objects from the pushshift archives directly
+into the (table, row, edited) tuples accepted by TSDB.insert_rows, without
+building pushshift.DummyObjects in between.
+
+The rows follow tsdb.SQL_SUBMISSION_COLUMNS and tsdb.SQL_COMMENT_COLUMNS, and
+hold the same values that TSDB.insert would store for the equivalent
+DummySubmission or DummyComment.
+
+This module deliberately does not import common, pushshift, or tsdb, because
+those import PRAW and log in to reddit. That way the ingest_jsonfile worker
+processes can load it quickly.
+'''
+import html
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is None:
+    json_loads = json.loads
+else:
+    json_loads = orjson.loads
+
+# Used to cheaply decide whether a line might belong to one of the routed
+# databases before paying for the full parse. These can also match the
+# crosspost_parent_list inside a submission, so the parsed object always gets
+# the final say.
+SUBREDDIT_PATTERN = re.compile(rb'"subreddit":\s*"([^"]*)"')
+AUTHOR_PATTERN = re.compile(rb'"author":\s*"([^"]*)"')
+
+def is_submission(obj):
+    return (
+        obj.get('name', '').startswith('t3_')
+        or obj.get('over_18') is not None
+    )
+
+def is_comment(obj):
+    return (
+        obj.get('name', '').startswith('t1_')
+        or obj.get('parent_id', '').startswith('t3_')
+        or obj.get('link_id', '').startswith('t3_')
+    )
+
+def _unescape(text):
+    if text is None:
+        return None
+    return html.unescape(text)
+
+def submission_row(obj):
+    selftext = _unescape(obj.get('selftext', ''))
+
+    if obj['is_self']:
+        # Selfpost's URL leads back to itself, so just ignore it.
+        url = None
+    elif 'crosspost_parent' in obj and obj['crosspost_parent_list']:
+        url = obj['crosspost_parent_list'][0]['permalink']
+    else:
+        url = obj.get('url', None)
+
+    if url and url.startswith('/r/'):
+        url = 'https://reddit.com' + url
+
+    # Order must match tsdb.SQL_SUBMISSION_COLUMNS.
+    row = (
+        int(obj['id'], 36),
+        't3_' + obj['id'],
+        obj['created_utc'],
+        obj['is_self'],
+        obj['over_18'],
+        obj['author'],
+        obj['title'],
+        url,
+        selftext,
+        obj.get('score', 0),
+        obj.get('subreddit', None),
+        obj.get('distinguished', None),
+        len(selftext),
+        obj['num_comments'],
+        obj.get('link_flair_text', None),
+        obj.get('link_flair_css_class', None),
+        None,
+        None,
+        None,
+    )
+    return row
+
+def comment_row(obj):
+    body = _unescape(obj['body'])
+
+    parent_id = obj.get('parent_id', None)
+    if parent_id is None:
+        parent_id = obj['link_id']
+    elif isinstance(parent_id, int):
+        parent_id = 't1_' + base36encode(parent_id)
+
+    # Order must match tsdb.SQL_COMMENT_COLUMNS.
+    row = (
+        int(obj['id'], 36),
+        't1_' + obj['id'],
+        obj['created_utc'],
+        obj['author'],
+        parent_id,
+        obj['link_id'],
+        body,
+        obj.get('score', 0),
+        obj.get('subreddit', None),
+        obj.get('distinguished', None),
+        len(body),
+        None,
+    )
+    return row
+
+def row_from_json(obj):
+    '''
+    Given a dict parsed from one line of a pushshift archive, return the
+    (table, row, edited) tuple for TSDB.insert_rows.
+    '''
+    if is_submission(obj):
+        return ('submissions', submission_row(obj), obj.get('edited', False))
+    elif is_comment(obj):
+        return ('comments', comment_row(obj), obj.get('edited', False))
+    else:
+        raise ValueError(f'Could not recognize object type {obj}.')
+
+def rows_from_lines(lines):
+    '''
+    Parse a block of lines from a pushshift archive into a list of
+    (table, row, edited) tuples. This is the unit of work for the
+    ingest_jsonfile worker processes.
+    '''
+    return [row_from_json(json_loads(line)) for line in lines]
+
+def routed_rows_from_lines(lines, subreddits, authors):
+    '''
+    Like rows_from_lines, but for a combined dump where only some items are
+    wanted. subreddits and authors are sets of lowercase names.
+
+    Return a list of (destinations, (table, row, edited)) where destinations
+    is a list of ('subreddit', name) and ('user', name) pairs.
+    '''
+    results = []
+    for line in lines:
+        maybe = (
+            any(name.decode().lower() in subreddits for name in SUBREDDIT_PATTERN.findall(line))
+            or any(name.decode().lower() in authors for name in AUTHOR_PATTERN.findall(line))
+        )
+        if not maybe:
+            continue
+
+        obj = json_loads(line)
+        destinations = []
+        subreddit = (obj.get('subreddit') or '').lower()
+        author = (obj.get('author') or '').lower()
+        if subreddit in subreddits:
+            destinations.append(('subreddit', subreddit))
+        if author in authors:
+            destinations.append(('user', author))
+        if destinations:
+            results.append((destinations, row_from_json(obj)))
+    return results
+
+def base36encode(number, alphabet='0123456789abcdefghijklmnopqrstuvwxyz'):
+    # A copy of common.base36encode, since we can't import common here.
+    base36 = ''
+    while number != 0:
+        (number, i) = divmod(number, len(alphabet))
+        base36 = alphabet[i] + base36
+    return base36 or alphabet[0]
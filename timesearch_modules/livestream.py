@@ -1,16 +1,58 @@
+import collections
+import concurrent.futures
 import copy
+import hashlib
+import json
 import prawcore
 import time
 import traceback
 
 from . import common
 from . import exceptions
+from . import metrics
+from . import pushshift
+from . import ratelimits
 from . import tsdb
 
+from voussoirkit import pathclass
 from voussoirkit import vlogging
 
 log = vlogging.get_logger(__name__)
 
+# The adaptive polling interval aims for each listing to come back about this
+# full, so that a burst of twice the usual activity still fits in one page.
+TARGET_FILL = 0.5
+
+# How much each new measurement moves a group's rate estimate.
+RATE_SMOOTHING = 0.5
+
+DEFAULT_MIN_SLEEPY = 5
+DEFAULT_MAX_SLEEPY = 600
+
+# When a listing comes back entirely new, we probably missed some items, so we
+# page further back until we reach items we already have. Reddit's listings
+# only go back about 1000 items anyway.
+MAX_CATCHUP_PAGES = 9
+
+# Reddit returns listings in pages of this many items.
+REDDIT_PAGE_SIZE = 100
+
+# The number of recently inserted items each source remembers, so that it can
+# skip the ones that haven't changed since.
+KNOWN_ITEMS_SIZE = 4000
+
+# How often to check whether the config file has changed, in seconds.
+CONFIG_CHECK_INTERVAL = 5
+
+# The options each source may have in the config file, and their defaults.
+CONFIG_OPTIONS = {
+    'submissions': True,
+    'comments': True,
+    'limit': 100,
+    'priority': 0,
+    'interval': None,
+}
+
 def _listify(x):
     '''
     The user may have given us a string containing multiple subreddits / users.
@@ -30,6 +72,8 @@ def generator_printer(generator):
     prev_message_length = 0
     for step in generator:
         newtext = '%s: +%ds, %dc' % (step['tsdb'].filepath.basename, step['new_submissions'], step['new_comments'])
+        if step.get('lag', None) is not None:
+            newtext += ', lag %ds' % step['lag']
         totalnew = step['new_submissions'] + step['new_comments']
         status = '{now} {new}'.format(now=common.human(common.get_now()), new=newtext)
         clear_prev = (' ' * prev_message_length) + '\r'
@@ -42,22 +86,6 @@ def generator_printer(generator):
             print()
         yield None
 
-def cycle_generators(generators, only_once, sleepy):
-    '''
-    Given multiple generators, yield an item from each one, cycling through
-    them in a round-robin fashion.
-
-    This is useful if you want to convert multiple livestream generators into a
-    single generator that take turns updating each of them and yields all of
-    their items.
-    '''
-    while True:
-        for generator in generators:
-            yield next(generator)
-        if only_once:
-            break
-        time.sleep(sleepy)
-
 def livestream(
         subreddit=None,
         username=None,
@@ -67,17 +95,73 @@ def livestream(
         limit=100,
         only_once=False,
         sleepy=30,
+        pragma_profile=None,
+        workers=1,
+        group_size=1,
+        min_sleepy=None,
+        max_sleepy=None,
+        metrics_port=None,
+        metrics_file=None,
+        metrics_interval=15,
+        config=None,
     ):
     '''
     Continuously get posts from this source and insert them into the database.
 
+    config:
+        The filepath of a livestream config file listing the sources, instead
+        of subreddit and username. See load_config. The file is checked for
+        changes every few seconds, and the sources are added, removed, and
+        reconfigured without restarting.
+
+    sleepy:
+        The number of seconds between the first polls of each source.
+        Afterwards, each source is polled more or less often depending on how
+        many new items it has been getting, between min_sleepy and max_sleepy
+        seconds. To poll at a fixed interval, set all three to the same value.
+
+    workers:
+        The number of sources to fetch from reddit at the same time. The
+        inserts all happen on the calling thread.
+
+    group_size:
+        Fetch up to this many subreddits together as one multireddit. This
+        saves a lot of requests, but each request still returns at most
+        `limit` items for the whole group.
+
+    metrics_port:
+        Serve Prometheus metrics at http://127.0.0.1:port/metrics.
+
+    metrics_file:
+        Rewrite this file with the Prometheus metrics every metrics_interval
+        seconds.
+
     as_a_generator:
         Return a generator where every iteration does a single livestream loop
         and yields the return value of TSDB.insert (A summary of new
         submission & comment count).
         This is useful if you want to manage the generator yourself.
         Otherwise, this function will run the generator forever.
+
+        These generators fetch and insert one poll at a time on the calling
+        thread, with none of the scheduling above, so as_a_generator can't be
+        combined with workers, group_size, config, or the metrics.
     '''
+    if config is not None and (subreddit or username):
+        raise exceptions.NotExclusive(['config', 'subreddit / username'])
+
+    if as_a_generator:
+        scheduled = {
+            'workers': workers != 1,
+            'group_size': group_size != 1,
+            'config': config is not None,
+            'metrics_port': metrics_port is not None,
+            'metrics_file': metrics_file is not None,
+        }
+        scheduled = [name for (name, given) in scheduled.items() if given]
+        if scheduled:
+            raise TypeError(f'as_a_generator does not support {", ".join(scheduled)}.')
+
     subreddits = _listify(subreddit)
     usernames = _listify(username)
     kwargs = {
@@ -85,22 +169,58 @@ def livestream(
         'do_comments': do_comments,
         'limit': limit,
         'params': {'show': 'all'},
+        'pragma_profile': pragma_profile,
     }
 
-    subreddit_generators = [
-        _livestream_as_a_generator(subreddit=subreddit, username=None, **kwargs) for subreddit in subreddits
-    ]
-    user_generators = [
-        _livestream_as_a_generator(subreddit=None, username=username, **kwargs) for username in usernames
-    ]
-    generators = subreddit_generators + user_generators
-
     if as_a_generator:
+        subreddit_generators = [
+            _livestream_as_a_generator(subreddit=subreddit, username=None, **kwargs) for subreddit in subreddits
+        ]
+        user_generators = [
+            _livestream_as_a_generator(subreddit=None, username=username, **kwargs) for username in usernames
+        ]
+        generators = subreddit_generators + user_generators
         if len(generators) == 1:
             return generators[0]
         return generators
 
-    generator = cycle_generators(generators, only_once=only_once, sleepy=sleepy)
+    if config is not None:
+        fleet = LivestreamFleet(config, group_size=group_size, pragma_profile=pragma_profile)
+        groups = fleet.groups
+        reload = fleet.reload
+    else:
+        sources = [LivestreamSource(subreddit=subreddit, **kwargs) for subreddit in subreddits]
+        sources += [LivestreamSource(username=username, **kwargs) for username in usernames]
+        groups = group_sources(sources, group_size=group_size)
+        reload = None
+
+    if workers > 1 and common.reddit_ratelimit is None:
+        # Each worker has its own PRAW instance with its own ratelimit, so
+        # they need one in common to stay within reddit's limit together.
+        common.reddit_ratelimit = ratelimits.AdaptiveRatelimiter(
+            allowance=pushshift.REDDIT_ALLOWANCE,
+            period=60,
+        )
+
+    if metrics_port is not None or metrics_file is not None:
+        livestream_metrics = metrics.LivestreamMetrics()
+    else:
+        livestream_metrics = None
+    if metrics_port is not None:
+        livestream_metrics.serve(metrics_port)
+    if metrics_file is not None:
+        livestream_metrics.write_periodically(metrics_file, metrics_interval)
+
+    generator = livestream_workers(
+        groups,
+        workers=workers,
+        sleepy=sleepy,
+        min_sleepy=min_sleepy,
+        max_sleepy=max_sleepy,
+        only_once=only_once,
+        metrics=livestream_metrics,
+        reload=reload,
+    )
     generator = generator_printer(generator)
 
     try:
@@ -109,6 +229,9 @@ def livestream(
     except KeyboardInterrupt:
         print()
         return
+    finally:
+        if metrics_file is not None:
+            livestream_metrics.write(metrics_file)
 
 hangman = lambda: livestream(
     username='gallowboob',
@@ -117,6 +240,583 @@ hangman = lambda: livestream(
     sleepy=60,
 )
 
+class KnownItems:
+    '''
+    A bounded record of the items a source has recently inserted, holding a
+    fingerprint of each one's score, comment count, and text. Most of every
+    livestream poll is items we already have, and the ones whose fingerprint
+    hasn't changed can skip the database entirely.
+    '''
+    def __init__(self, size=KNOWN_ITEMS_SIZE):
+        self.size = size
+        self.fingerprints = collections.OrderedDict()
+
+    def __contains__(self, fullname):
+        return fullname in self.fingerprints
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    @staticmethod
+    def fingerprint(item):
+        if item.fullname.startswith('t3_'):
+            text = item.selftext
+            counts = (item.score, item.num_comments)
+        else:
+            text = item.body
+            counts = (item.score,)
+        text_hash = hashlib.md5((text or '').encode('utf-8')).digest()
+        return (counts, text_hash)
+
+    def changed(self, item):
+        '''
+        Return True if we don't know this item, or it has changed since we
+        remembered it.
+        '''
+        return self.fingerprints.get(item.fullname, None) != self.fingerprint(item)
+
+    def remember(self, items):
+        for item in items:
+            self.fingerprints[item.fullname] = self.fingerprint(item)
+            self.fingerprints.move_to_end(item.fullname)
+        while len(self.fingerprints) > self.size:
+            self.fingerprints.popitem(last=False)
+
+class LivestreamSource:
+    '''
+    One subreddit or user being livestreamed into its database.
+
+    Fetching and inserting are separate steps so that the fetch can happen on
+    a worker thread while the insert happens on the thread that owns the
+    database connection.
+    '''
+    def __init__(
+            self,
+            subreddit=None,
+            username=None,
+            *,
+            do_submissions=True,
+            do_comments=True,
+            limit=100,
+            params=None,
+            pragma_profile=None,
+            priority=0,
+            interval=None,
+        ):
+        '''
+        priority:
+            When more sources are due than there are free workers, the ones
+            with higher priority are fetched first.
+
+        interval:
+            Poll this source every this many seconds, instead of adapting to
+            its activity.
+        '''
+        if not common.is_xor(subreddit, username):
+            raise exceptions.NotExclusive(['subreddit', 'username'])
+
+        if not any([do_submissions, do_comments]):
+            raise TypeError('Required do_submissions and/or do_comments parameter')
+        common.login()
+
+        if subreddit:
+            log.debug('Getting subreddit %s', subreddit)
+            (self.database, self.name) = tsdb.TSDB.for_subreddit(subreddit, fix_name=True, pragma_profile=pragma_profile)
+        else:
+            log.debug('Getting redditor %s', username)
+            (self.database, self.name) = tsdb.TSDB.for_user(username, fix_name=True, pragma_profile=pragma_profile)
+        self.is_subreddit = bool(subreddit)
+
+        self.params = params
+        self.known = KnownItems()
+        self.configure(
+            do_submissions=do_submissions,
+            do_comments=do_comments,
+            limit=limit,
+            priority=priority,
+            interval=interval,
+        )
+
+        # The created_utc of the newest item we've seen, for measuring lag.
+        self.newest_created = None
+
+    def __repr__(self):
+        return f'LivestreamSource({self.database.filepath.basename})'
+
+    def configure(self, *, do_submissions, do_comments, limit, priority, interval):
+        '''
+        Change the source's options in place, so that its database and known
+        items carry over.
+        '''
+        if not any([do_submissions, do_comments]):
+            raise TypeError('Required do_submissions and/or do_comments parameter')
+        self.do_submissions = do_submissions
+        self.do_comments = do_comments
+        self.limit = limit
+        self.priority = priority
+        self.interval = interval
+        self.known.size = max(KNOWN_ITEMS_SIZE, 4 * limit)
+
+    @property
+    def lag(self):
+        '''
+        The number of seconds between the newest item we have from this
+        source and now, or None if we haven't seen any yet.
+        '''
+        if self.newest_created is None:
+            return None
+        return common.get_now() - self.newest_created
+
+    def empty_step(self):
+        return {
+            'tsdb': self.database,
+            'source': self.name,
+            'new_comments': 0,
+            'new_submissions': 0,
+            'lag': self.lag,
+        }
+
+    def fetch(self, reddit, name=None, after=None, known=None):
+        '''
+        Return the newest items from this source, using the given Reddit
+        instance. This does not touch the database.
+
+        name:
+            Fetch from this subreddit name instead, which LivestreamGroup uses
+            to fetch a multireddit with the same settings as this source.
+
+        after:
+            A dict of {'submissions': fullname, 'comments': fullname}. If
+            given, only those listings are fetched, each starting after its
+            fullname instead of from the newest item.
+
+        known:
+            A function that takes a fullname and returns True if we already
+            have that item. Listings stop at the end of the page where the
+            first known item appears. Default is this source's KnownItems.
+        '''
+        if known is None:
+            known = self.known.__contains__
+
+        if self.is_subreddit:
+            subreddit = reddit.subreddit(name or self.name)
+            submission_function = subreddit.new if self.do_submissions else None
+            comment_function = subreddit.comments if self.do_comments else None
+        else:
+            user = reddit.redditor(self.name)
+            submission_function = user.submissions.new if self.do_submissions else None
+            comment_function = user.comments.new if self.do_comments else None
+
+        if after is not None:
+            results = []
+            if 'submissions' in after:
+                results.extend(_livestream_helper(
+                    submission_function=submission_function,
+                    known=known,
+                    limit=self.limit,
+                    params={**(self.params or {}), 'after': after['submissions']},
+                ))
+            if 'comments' in after:
+                results.extend(_livestream_helper(
+                    comment_function=comment_function,
+                    known=known,
+                    limit=self.limit,
+                    params={**(self.params or {}), 'after': after['comments']},
+                ))
+            return results
+
+        return _livestream_helper(
+            submission_function=submission_function,
+            comment_function=comment_function,
+            known=known,
+            limit=self.limit,
+            params=self.params,
+        )
+
+    def insert(self, items):
+        '''
+        Insert the items that are new or have changed since we last saw them.
+        '''
+        if items:
+            newest = max(item.created_utc for item in items)
+            self.newest_created = max(newest, self.newest_created or 0)
+
+        changed = [item for item in items if self.known.changed(item)]
+        log.debug('%s skipping %d unchanged items.', self, len(items) - len(changed))
+        if not changed:
+            return self.empty_step()
+
+        # The first poll is mostly a backlog of items that were created before
+        # we started, which would distort the ingest lag.
+        if len(self.known) > 0:
+            now = time.time()
+            ingest_lags = [now - item.created_utc for item in changed if item.fullname not in self.known]
+        else:
+            ingest_lags = []
+
+        start = time.perf_counter()
+        step = self.database.insert(changed)
+        insert_seconds = time.perf_counter() - start
+
+        self.known.remember(changed)
+        new = step['new_submissions'] + step['new_comments']
+        step.update({
+            'source': self.name,
+            'lag': self.lag,
+            'updated': len(changed) - new,
+            'ingest_lags': ingest_lags,
+            'insert_seconds': insert_seconds,
+        })
+        return step
+
+    def failed(self, exc):
+        '''
+        Report the exception raised by fetch or insert, and return an empty step
+        so that the livestream can continue.
+        '''
+        if isinstance(exc, prawcore.exceptions.NotFound):
+            print(self.database.filepath.basename, '404 not found')
+        else:
+            traceback.print_exception(type(exc), exc, exc.__traceback__)
+            print('Retrying...')
+        step = self.empty_step()
+        step['error'] = type(exc).__name__
+        return step
+
+class LivestreamGroup:
+    '''
+    One or more sources that are fetched with a single set of requests. Reddit
+    serves combined listings for multireddits like a+b+c, so subreddits with
+    the same settings can share their requests, and the items are routed back
+    to each source's database by their subreddit.
+    '''
+    def __init__(self, sources):
+        self.sources = list(sources)
+        if len(self.sources) > 1 and not all(source.is_subreddit for source in self.sources):
+            raise TypeError('Only subreddit sources can be grouped.')
+        self.name = '+'.join(source.name for source in self.sources)
+        self.routes = {source.name.lower(): source for source in self.sources}
+
+        # {'submissions': fullname, 'comments': fullname} for the listings
+        # that are paging back to fill a gap, and how many pages so far.
+        self.catchup = {}
+        self.catchup_pages = 0
+
+    def __repr__(self):
+        return f'LivestreamGroup({self.name})'
+
+    @property
+    def interval(self):
+        return self.sources[0].interval
+
+    @property
+    def limit(self):
+        return self.sources[0].limit
+
+    @property
+    def priority(self):
+        return max(source.priority for source in self.sources)
+
+    def fetch(self, reddit):
+        after = dict(self.catchup) if self.catchup else None
+        return self.sources[0].fetch(reddit, name=self.name, after=after, known=self.known)
+
+    def known(self, fullname):
+        return any(fullname in source.known for source in self.sources)
+
+    def insert(self, items):
+        '''
+        Insert the items into their sources' databases, returning a list of
+        steps, one per source.
+        '''
+        steps = self._route(items)
+        self._plan_catchup(items, steps)
+        return steps
+
+    def _plan_catchup(self, items, steps):
+        '''
+        If a listing came back full and every item in it was new, then there
+        are probably more new items behind it, so the next fetch continues
+        from the last item of that listing.
+        '''
+        listings = {'submissions': [], 'comments': []}
+        for item in items:
+            kind = 'submissions' if item.fullname.startswith('t3_') else 'comments'
+            listings[kind].append(item)
+
+        if self.catchup:
+            self.catchup_pages += 1
+        else:
+            self.catchup_pages = 0
+
+        self.catchup = {}
+        if self.catchup_pages >= MAX_CATCHUP_PAGES:
+            log.debug('%s gave up catching up after %d pages.', self, self.catchup_pages)
+            return
+
+        for (kind, listing) in listings.items():
+            new = sum(step['new_' + kind] for step in steps)
+            if len(listing) >= self.limit and new == len(listing):
+                log.debug('%s got a page of only new %s, paging back.', self, kind)
+                self.catchup[kind] = listing[-1].fullname
+
+    def _route(self, items):
+        if len(self.sources) == 1:
+            return [self.sources[0].insert(items)]
+
+        routed = {name: [] for name in self.routes}
+        for item in items:
+            name = item.subreddit.display_name.lower()
+            if name in routed:
+                routed[name].append(item)
+            else:
+                log.debug('%s got an item from unexpected subreddit %s.', self, name)
+        return [source.insert(routed[name]) for (name, source) in self.routes.items()]
+
+    def failed(self, exc):
+        self.catchup = {}
+        if len(self.sources) == 1:
+            return [self.sources[0].failed(exc)]
+
+        traceback.print_exception(type(exc), exc, exc.__traceback__)
+        print(self.name, 'retrying...')
+        steps = [source.empty_step() for source in self.sources]
+        for step in steps:
+            step['error'] = type(exc).__name__
+        return steps
+
+def group_sources(sources, group_size):
+    '''
+    Combine the subreddit sources that want the same listings into
+    LivestreamGroups of up to group_size. Each user is a group of its own,
+    because reddit has no combined listing for users.
+    '''
+    groups = []
+    similar = {}
+    for source in sources:
+        if not source.is_subreddit or group_size <= 1:
+            groups.append(LivestreamGroup([source]))
+            continue
+        key = (source.do_submissions, source.do_comments, source.limit, source.interval, repr(source.params))
+        similar.setdefault(key, []).append(source)
+
+    for bucket in similar.values():
+        for chunk in common.generator_chunker(bucket, group_size):
+            groups.append(LivestreamGroup(chunk))
+    return groups
+
+class PollInterval:
+    '''
+    Chooses how long to wait between the polls of one group. We keep a
+    smoothed estimate of how many new items per second the group's busiest
+    listing gets, and wait long enough for it to fill about TARGET_FILL of a
+    page. Busy groups are polled often enough that they don't overflow, and
+    quiet ones are left alone.
+    '''
+    def __init__(self, initial, minimum, maximum, limit):
+        self.interval = min(maximum, max(minimum, initial))
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = limit
+        self.rate = None
+        self.polled_at = None
+        # The new items of a poll arrived between the start of the previous
+        # poll and the start of this one.
+        self.window = None
+        self.new_items = 0
+
+    def __repr__(self):
+        return f'PollInterval({self.interval:.1f}s, rate={self.rate})'
+
+    def started(self, now):
+        '''
+        Call this when a normal poll begins, not a catch-up page, which only
+        adds to the items of the poll it belongs to.
+        '''
+        if self.polled_at is not None:
+            self.window = now - self.polled_at
+        self.polled_at = now
+        self.new_items = 0
+
+    def finished(self, steps, done):
+        '''
+        Call this with the insert steps of every page of the poll. done is
+        False if the poll is going to page further back.
+
+        A poll that failed tells us nothing about the rate, so it isn't
+        measured. Otherwise its zero new items would slow down the polling of
+        a source that keeps failing.
+        '''
+        if any(step.get('error', None) for step in steps):
+            return
+
+        new_submissions = sum(step['new_submissions'] for step in steps)
+        new_comments = sum(step['new_comments'] for step in steps)
+        self.new_items += max(new_submissions, new_comments)
+        if done and self.window:
+            self._measure()
+
+    def _measure(self):
+        observed = self.new_items / self.window
+        if self.rate is None:
+            self.rate = observed
+        else:
+            self.rate = (RATE_SMOOTHING * observed) + ((1 - RATE_SMOOTHING) * self.rate)
+
+        if self.rate == 0:
+            interval = self.maximum
+        else:
+            interval = (self.limit * TARGET_FILL) / self.rate
+        self.interval = min(self.maximum, max(self.minimum, interval))
+        log.debug('New poll interval %s.', self)
+
+def load_config(filepath):
+    '''
+    Read a livestream config file, which is JSON like this:
+
+        {
+            "defaults": {"comments": false},
+            "sources": [
+                {"subreddit": "askreddit", "comments": true, "priority": 1},
+                {"subreddit": "learnpython", "interval": 300},
+                {"user": "gallowboob", "limit": 25}
+            ]
+        }
+
+    Each source has exactly one of "subreddit" or "user", and any of the
+    options in CONFIG_OPTIONS. The options in "defaults" apply to every source
+    that doesn't set its own.
+
+    Return a list of dicts, each with "subreddit" or "username" and every one
+    of the options.
+    '''
+    filepath = pathclass.Path(filepath)
+    try:
+        config = json.loads(filepath.read('r', encoding='utf-8'))
+    except (OSError, ValueError) as exc:
+        raise exceptions.InvalidLivestreamConfig(filepath.absolute_path, exc)
+
+    def invalid(message):
+        return exceptions.InvalidLivestreamConfig(filepath.absolute_path, message)
+
+    if not isinstance(config, dict) or not isinstance(config.get('sources', None), list):
+        raise invalid('Expected an object with a "sources" list.')
+
+    defaults = {**CONFIG_OPTIONS, **config.get('defaults', {})}
+    unknown = set(defaults) - set(CONFIG_OPTIONS)
+    if unknown:
+        raise invalid(f'Unknown default options {sorted(unknown)}.')
+
+    specs = []
+    for source in config['sources']:
+        if not isinstance(source, dict) or not common.is_xor(source.get('subreddit'), source.get('user')):
+            raise invalid(f'Each source needs one of "subreddit" or "user": {source}')
+        unknown = set(source) - set(CONFIG_OPTIONS) - {'subreddit', 'user'}
+        if unknown:
+            raise invalid(f'Unknown options {sorted(unknown)} in {source}.')
+
+        spec = {**defaults, **source}
+        if not (spec['submissions'] or spec['comments']):
+            raise invalid(f'{source} collects neither submissions nor comments.')
+        if not isinstance(spec['limit'], int) or spec['limit'] < 1:
+            raise invalid(f'{source} has an invalid limit.')
+        if spec['interval'] is not None and not (isinstance(spec['interval'], (int, float)) and spec['interval'] > 0):
+            raise invalid(f'{source} has an invalid interval.')
+        if not isinstance(spec['priority'], (int, float)):
+            raise invalid(f'{source} has an invalid priority.')
+
+        spec['username'] = spec.pop('user', None)
+        spec.setdefault('subreddit', None)
+        specs.append(spec)
+
+    return specs
+
+class LivestreamFleet:
+    '''
+    The sources listed in a livestream config file, kept in sync with the
+    file. Reloading reuses the LivestreamSources of the names that are still
+    listed, so their databases stay open and their known items stay warm, and
+    it reuses the LivestreamGroups whose members didn't change, so that they
+    keep their place in the schedule.
+    '''
+    def __init__(self, filepath, *, group_size=1, pragma_profile=None):
+        self.filepath = pathclass.Path(filepath)
+        self.group_size = group_size
+        self.pragma_profile = pragma_profile
+        self.sources = {}
+        self.groups = []
+        self.mtime = None
+        self.load()
+
+    def __repr__(self):
+        return f'LivestreamFleet({self.filepath.absolute_path})'
+
+    def load(self):
+        self.mtime = self.filepath.stat.st_mtime
+        specs = load_config(self.filepath)
+
+        # All of the new sources are opened before anything is changed, so
+        # that a failure leaves the fleet as it was.
+        sources = {}
+        for spec in specs:
+            name = spec['subreddit'] or spec['username']
+            key = ('subreddit' if spec['subreddit'] else 'user', name.lower())
+            if key in sources:
+                continue
+            source = self.sources.get(key, None)
+            if source is None:
+                source = LivestreamSource(
+                    subreddit=spec['subreddit'],
+                    username=spec['username'],
+                    params={'show': 'all'},
+                    pragma_profile=self.pragma_profile,
+                )
+            sources[key] = (source, spec)
+
+        for (source, spec) in sources.values():
+            source.configure(
+                do_submissions=spec['submissions'],
+                do_comments=spec['comments'],
+                limit=spec['limit'],
+                priority=spec['priority'],
+                interval=spec['interval'],
+            )
+
+        for (key, source) in self.sources.items():
+            if key not in sources:
+                log.info('Removing %s from the livestream.', source)
+                source.database.close()
+
+        self.sources = {key: source for (key, (source, spec)) in sources.items()}
+        previous_groups = {tuple(group.sources): group for group in self.groups}
+        groups = group_sources(self.sources.values(), group_size=self.group_size)
+        self.groups = [previous_groups.get(tuple(group.sources), group) for group in groups]
+        log.info('Loaded %d sources in %d groups from %s.', len(self.sources), len(self.groups), self.filepath.absolute_path)
+        return self.groups
+
+    def reload(self):
+        '''
+        If the config file has changed since we last loaded it, load it again
+        and return the new list of groups. Otherwise, or if the new config is
+        invalid, return None and keep going with the current groups.
+        '''
+        try:
+            mtime = self.filepath.stat.st_mtime
+        except FileNotFoundError:
+            log.warning('%s is missing, keeping the current sources.', self.filepath.absolute_path)
+            return None
+
+        if mtime == self.mtime:
+            return None
+
+        try:
+            return self.load()
+        except Exception:
+            log.exception('Failed to reload %s, keeping the current sources.', self.filepath.absolute_path)
+            self.mtime = mtime
+            return None
+
 def _livestream_as_a_generator(
         subreddit,
         username,
@@ -124,60 +824,213 @@ def _livestream_as_a_generator(
         do_comments,
         limit,
         params,
+        pragma_profile=None,
+    ):
+    source = LivestreamSource(
+        subreddit=subreddit,
+        username=username,
+        do_submissions=do_submissions,
+        do_comments=do_comments,
+        limit=limit,
+        params=params,
+        pragma_profile=pragma_profile,
+    )
+
+    while True:
+        try:
+            items = source.fetch(common.r)
+            yield source.insert(items)
+        except Exception as exc:
+            yield source.failed(exc)
+
+def livestream_workers(
+        groups,
+        workers,
+        sleepy,
+        min_sleepy=None,
+        max_sleepy=None,
+        only_once=False,
+        metrics=None,
+        reload=None,
     ):
+    '''
+    Fetch the LivestreamGroups on a pool of worker threads, and insert their
+    items from this thread, which is the only one that writes to the
+    databases. Yield the insert summary of every source in every poll, like
+    _livestream_as_a_generator.
 
-    if not common.is_xor(subreddit, username):
-        raise exceptions.NotExclusive(['subreddit', 'username'])
+    Each group is polled again its PollInterval after its previous poll
+    began, so a slow or failing group only delays itself. A group that is
+    catching up is polled again right away. If only_once, every group is
+    polled once, plus its catch-up pages, and then we return.
 
-    if not any([do_submissions, do_comments]):
-        raise TypeError('Required do_submissions and/or do_comments parameter')
-    common.login()
+    When several groups are due at once, they are fetched in order of their
+    priority.
 
-    if subreddit:
-        log.debug('Getting subreddit %s', subreddit)
-        (database, subreddit) = tsdb.TSDB.for_subreddit(subreddit, fix_name=True)
-        subreddit = common.r.subreddit(subreddit)
-        submission_function = subreddit.new if do_submissions else None
-        comment_function = subreddit.comments if do_comments else None
-    else:
-        log.debug('Getting redditor %s', username)
-        (database, username) = tsdb.TSDB.for_user(username, fix_name=True)
-        user = common.r.redditor(username)
-        submission_function = user.submissions.new if do_submissions else None
-        comment_function = user.comments.new if do_comments else None
+    metrics:
+        A metrics.LivestreamMetrics which will record every step.
 
-    while True:
+    reload:
+        A function, such as LivestreamFleet.reload, which returns a new list
+        of groups when the sources have changed, or None. It is called every
+        CONFIG_CHECK_INTERVAL seconds. Groups that remain in the list keep
+        their schedule, and the results of removed groups that were still in
+        flight are thrown away.
+    '''
+    if min_sleepy is None:
+        min_sleepy = min(sleepy, DEFAULT_MIN_SLEEPY)
+    if max_sleepy is None:
+        max_sleepy = max(sleepy, DEFAULT_MAX_SLEEPY)
+    if only_once:
+        reload = None
+
+    def poll_interval(group):
+        if group.interval is not None:
+            return PollInterval(group.interval, minimum=group.interval, maximum=group.interval, limit=group.limit)
+        return PollInterval(sleepy, minimum=min_sleepy, maximum=max_sleepy, limit=group.limit)
+
+    intervals = {group: poll_interval(group) for group in groups}
+    next_poll = {group: 0 for group in groups}
+    in_flight = {}
+    next_reload = time.monotonic() + CONFIG_CHECK_INTERVAL
+
+    def apply_reload(groups):
+        for group in list(intervals):
+            if group not in groups:
+                intervals.pop(group)
+                next_poll.pop(group, None)
+
+        for group in groups:
+            current = intervals.get(group, None)
+            wanted = poll_interval(group)
+            if current is not None and (current.initial, current.minimum, current.maximum, current.limit) == \
+                    (wanted.initial, wanted.minimum, wanted.maximum, wanted.limit):
+                continue
+            intervals[group] = wanted
+            if current is None or group not in in_flight.values():
+                next_poll[group] = 0
+
+    def fetch(group):
+        # Exceptions are returned instead of raised so that we still know how
+        # long the failed request took.
+        reddit = common.thread_reddit()
+        start = time.perf_counter()
         try:
-            items = _livestream_helper(
-                submission_function=submission_function,
-                comment_function=comment_function,
-                limit=limit,
-                params=params,
+            items = group.fetch(reddit)
+        except Exception as exc:
+            return (None, exc, time.perf_counter() - start)
+        return (items, None, time.perf_counter() - start)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='livestream') as executor:
+        while next_poll or in_flight or reload is not None:
+            now = time.monotonic()
+            if reload is not None and now >= next_reload:
+                next_reload = now + CONFIG_CHECK_INTERVAL
+                new_groups = reload()
+                if new_groups is not None:
+                    apply_reload(new_groups)
+
+            busy = set(in_flight.values())
+            due = [group for (group, due) in next_poll.items() if group not in busy and due <= now]
+            due.sort(key=lambda group: group.priority, reverse=True)
+            for group in due:
+                in_flight[executor.submit(fetch, group)] = group
+                if not group.catchup:
+                    intervals[group].started(now)
+                if only_once:
+                    next_poll.pop(group)
+                else:
+                    next_poll[group] = now + intervals[group].interval
+
+            busy = set(in_flight.values())
+            idle = [due for (group, due) in next_poll.items() if group not in busy]
+            timeout = max(0, min(idle) - now) if idle else None
+            if reload is not None:
+                until_reload = max(0, next_reload - now)
+                timeout = until_reload if timeout is None else min(timeout, until_reload)
+            if not in_flight:
+                time.sleep(timeout)
+                continue
+
+            (done, pending) = concurrent.futures.wait(
+                in_flight,
+                timeout=timeout,
+                return_when=concurrent.futures.FIRST_COMPLETED,
             )
-            newitems = database.insert(items)
-            yield newitems
-        except prawcore.exceptions.NotFound:
-            print(database.filepath.basename, '404 not found')
-            step = {'tsdb': database, 'new_comments': 0, 'new_submissions': 0}
-            yield step
-        except Exception:
-            traceback.print_exc()
-            print('Retrying...')
-            step = {'tsdb': database, 'new_comments': 0, 'new_submissions': 0}
-            yield step
+            for future in done:
+                group = in_flight.pop(future)
+                if group not in intervals:
+                    log.debug('Discarding the results of removed %s.', group)
+                    continue
+                (items, error, fetch_seconds) = future.result()
+                try:
+                    if error is not None:
+                        raise error
+                    steps = group.insert(items)
+                except Exception as exc:
+                    steps = group.failed(exc)
+
+                intervals[group].finished(steps, done=not group.catchup)
+                if group.catchup:
+                    next_poll[group] = 0
+                elif not only_once:
+                    next_poll[group] = intervals[group].polled_at + intervals[group].interval
+
+                if metrics is not None:
+                    metrics.observe_poll(
+                        group.name,
+                        steps,
+                        fetch_seconds=fetch_seconds,
+                        interval=intervals[group].interval,
+                        busy_workers=len(in_flight),
+                    )
+                yield from steps
+
+def _consume_listing(listing, known, limit=None):
+    '''
+    Collect up to `limit` items of the listing, but stop requesting more pages
+    once we reach a page with an item we already know, because everything
+    after it is older. The rest of that page is still collected, since it's
+    already been downloaded and may have new scores.
+
+    PRAW requests each page when we take its first item, so that is when we
+    spend from the reddit ratelimit, once per page.
+    '''
+    results = []
+    reached_known = False
+    listing = iter(listing)
+    while limit is None or len(results) < limit:
+        if len(results) % REDDIT_PAGE_SIZE == 0:
+            if reached_known:
+                log.debug('Stopping the listing at a known item.')
+                break
+            common.limit_reddit()
+        item = next(listing, None)
+        if item is None:
+            break
+        results.append(item)
+        reached_known = reached_known or known(item.fullname)
+    return results
 
 def _livestream_helper(
         submission_function=None,
         comment_function=None,
         *args,
+        known=None,
         **kwargs,
     ):
     '''
     Given a submission-retrieving function and/or a comment-retrieving function,
     collect submissions and comments in a list together and return that.
 
+    known:
+        Passed to _consume_listing, if given.
+
     args and kwargs go into the collecting functions.
     '''
+    if known is None:
+        known = lambda fullname: False
+
     if not any([submission_function, comment_function]):
         raise TypeError('Required submissions and/or comments parameter')
     results = []
@@ -186,16 +1039,18 @@ def _livestream_helper(
         log.debug('Getting submissions %s %s', args, kwargs)
         this_kwargs = copy.deepcopy(kwargs)
         submission_batch = submission_function(*args, **this_kwargs)
-        results.extend(submission_batch)
+        results.extend(_consume_listing(submission_batch, known, limit=kwargs.get('limit', None)))
     if comment_function:
         log.debug('Getting comments %s %s', args, kwargs)
         this_kwargs = copy.deepcopy(kwargs)
         comment_batch = comment_function(*args, **this_kwargs)
-        results.extend(comment_batch)
+        results.extend(_consume_listing(comment_batch, known, limit=kwargs.get('limit', None)))
     log.debug('Got %d posts', len(results))
     return results
 
 def livestream_argparse(args):
+    pushshift.use_shared_ratelimit_argparse(args)
+
     if args.submissions is args.comments is False:
         args.submissions = True
         args.comments = True
@@ -212,4 +1067,13 @@ def livestream_argparse(args):
         limit=limit,
         only_once=args.once,
         sleepy=int(args.sleepy),
+        min_sleepy=common.int_none(args.min_sleepy),
+        max_sleepy=common.int_none(args.max_sleepy),
+        pragma_profile=args.pragma_profile,
+        workers=int(args.workers),
+        group_size=int(args.group_size),
+        metrics_port=common.int_none(args.metrics_port),
+        metrics_file=args.metrics_file,
+        metrics_interval=int(args.metrics_interval),
+        config=args.config,
     )
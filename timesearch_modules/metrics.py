@@ -0,0 +1,259 @@
+'''
+A small collection of counters, gauges, and histograms that can be rendered in
+the Prometheus text format, either served over HTTP for a Prometheus scraper
+or written to a file for node_exporter's textfile collector or a human.
+
+We only need a handful of metrics, so this doesn't depend on prometheus_client.
+'''
+import http.server
+import os
+import threading
+import time
+
+from voussoirkit import pathclass
+from voussoirkit import vlogging
+
+log = vlogging.get_logger(__name__)
+
+SECONDS_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+LAG_BUCKETS = [5, 15, 30, 60, 120, 300, 600, 1800, 3600, 21600, 86400]
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = []
+    for (key, value) in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(sorted(labels.items()))
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for (labels, value) in sorted(self.values.items()):
+            lines.append(f'{self.name}{_format_labels(labels)} {_format_value(value)}')
+        return lines
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets):
+        super().__init__(name, help)
+        self.buckets = sorted(buckets) + [float('inf')]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        if key not in self.values:
+            self.values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+        series = self.values[key]
+        for (index, bound) in enumerate(self.buckets):
+            if value <= bound:
+                series['buckets'][index] += 1
+        series['sum'] += value
+        series['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for (labels, series) in sorted(self.values.items()):
+            for (bound, count) in zip(self.buckets, series['buckets']):
+                bucket_labels = labels + (('le', _format_value(bound)),)
+                lines.append(f'{self.name}_bucket{_format_labels(bucket_labels)} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(series["sum"])}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {series["count"]}')
+        return lines
+
+class Registry:
+    '''
+    Holds the metrics, and a lock so that they can be updated by the
+    livestream while the HTTP server or the file writer reads them.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        return self._add(Counter(name, help))
+
+    def gauge(self, name, help):
+        return self._add(Gauge(name, help))
+
+    def histogram(self, name, help, buckets=SECONDS_BUCKETS):
+        return self._add(Histogram(name, help, buckets))
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for metric in self.metrics:
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        '''
+        Serve the metrics at http://host:port/metrics from a daemon thread.
+        Return the server, so the caller can shut it down.
+        '''
+        registry = self
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True, name='metrics').start()
+        log.info('Serving metrics at http://%s:%d/metrics', host, server.server_port)
+        return server
+
+    def write(self, filepath):
+        '''
+        Replace the file with the current metrics. The text is written to a
+        temporary file first so that readers never see half of it.
+        '''
+        filepath = pathclass.Path(filepath)
+        temp = filepath.parent.with_child(filepath.basename + '.tmp')
+        with temp.open('w', encoding='utf-8') as handle:
+            handle.write(self.render())
+        os.replace(temp.absolute_path, filepath.absolute_path)
+
+    def write_periodically(self, filepath, interval):
+        '''
+        Rewrite the file every interval seconds from a daemon thread.
+        '''
+        def loop():
+            while True:
+                try:
+                    self.write(filepath)
+                except Exception:
+                    log.exception('Failed to write metrics to %s.', filepath)
+                time.sleep(interval)
+
+        thread = threading.Thread(target=loop, daemon=True, name='metrics')
+        thread.start()
+        return thread
+
+class LivestreamMetrics(Registry):
+    '''
+    The metrics of a livestream. The ones about requests are labeled by group,
+    which is the name that was fetched, like a multireddit a+b+c, or just the
+    subreddit or user name when it isn't grouped. The ones about items and
+    databases are labeled by source, the subreddit or user name.
+    '''
+    def __init__(self):
+        super().__init__()
+        self.polls = self.counter(
+            'timesearch_livestream_polls_total',
+            'Completed polls of this group, including failed ones.',
+        )
+        self.errors = self.counter(
+            'timesearch_livestream_errors_total',
+            'Polls of this group that raised an exception.',
+        )
+        self.new_items = self.counter(
+            'timesearch_livestream_new_items_total',
+            'Items inserted into the database for the first time.',
+        )
+        self.updated_items = self.counter(
+            'timesearch_livestream_updated_items_total',
+            'Items already in the database that were written again because they changed.',
+        )
+        self.fetch_seconds = self.histogram(
+            'timesearch_livestream_fetch_seconds',
+            'Time spent requesting listings from reddit, per poll of this group.',
+        )
+        self.insert_seconds = self.histogram(
+            'timesearch_livestream_insert_seconds',
+            'Time spent writing this source to its database, per poll.',
+        )
+        self.ingest_lag = self.histogram(
+            'timesearch_livestream_ingest_lag_seconds',
+            'Seconds between an item being created and us inserting it.',
+            buckets=LAG_BUCKETS,
+        )
+        self.lag = self.gauge(
+            'timesearch_livestream_lag_seconds',
+            'Age of the newest item we have from this source.',
+        )
+        self.interval = self.gauge(
+            'timesearch_livestream_poll_interval_seconds',
+            'Current time between polls of this group.',
+        )
+        self.last_poll = self.gauge(
+            'timesearch_livestream_last_poll_timestamp_seconds',
+            'Unix time when this source last finished a poll.',
+        )
+        self.busy_workers = self.gauge(
+            'timesearch_livestream_busy_workers',
+            'Worker threads currently fetching from reddit.',
+        )
+
+    def observe_poll(self, group, steps, fetch_seconds, interval, busy_workers):
+        '''
+        Record one poll of a group: its request once, and then each of its
+        sources' steps, as returned by LivestreamGroup.insert or
+        LivestreamGroup.failed.
+        '''
+        with self.lock:
+            self.polls.inc(group=group)
+            errors = {step['error'] for step in steps if step.get('error', None)}
+            for error in errors:
+                self.errors.inc(group=group, error=error)
+            if fetch_seconds is not None:
+                self.fetch_seconds.observe(fetch_seconds, group=group)
+            self.interval.set(round(interval, 3), group=group)
+            self.busy_workers.set(busy_workers)
+            for step in steps:
+                self._observe_step(step)
+
+    def _observe_step(self, step):
+        source = step['source']
+        self.new_items.inc(step['new_submissions'], source=source, kind='submissions')
+        self.new_items.inc(step['new_comments'], source=source, kind='comments')
+        self.updated_items.inc(step.get('updated', 0), source=source)
+        if not step.get('error', None):
+            self.insert_seconds.observe(step.get('insert_seconds', 0), source=source)
+        for lag in step.get('ingest_lags', []):
+            self.ingest_lag.observe(lag, source=source)
+        if step.get('lag', None) is not None:
+            self.lag.set(step['lag'], source=source)
+        self.last_poll.set(int(time.time()), source=source)
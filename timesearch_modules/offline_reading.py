@@ -297,37 +297,63 @@ def sanitize_braces(text):
 
 def trees_from_database(database, specific_submission=None):
     '''
-    Given a timesearch database, take all of the submission
-    ids, take all of the comments for each submission id, and run them
-    through `tree_from_submission`.
-
-    Yield each submission's tree as it is generated.
+    Given a timesearch database, build the comment tree of each submission
+    (or one particular submission fullname), and yield each tree as it is
+    finished.
+
+    The submissions and the comments are each read with a single query, both
+    ordered by submission id, so the comments of each submission can be taken
+    off the front of the comment stream as we go, by _merge_comments. The
+    comments come out of comment_submission_index already in that order.
+    Trees are yielded in order of submission id.
     '''
-    cur1 = database.sql.cursor()
-    cur2 = database.sql.cursor()
+    submission_cur = database.sql.cursor()
+    comment_cur = database.sql.cursor()
 
     if specific_submission is None:
-        cur1.execute('SELECT idstr FROM submissions ORDER BY created ASC')
-        submission_ids = common.fetchgenerator(cur1)
-        # sql always returns rows as tuples, even when selecting one column.
-        submission_ids = (x[0] for x in submission_ids)
+        submission_cur.execute('SELECT * FROM submissions ORDER BY idstr')
+        comment_cur.execute('SELECT * FROM comments WHERE submission IS NOT NULL ORDER BY submission, created')
     else:
         specific_submission = common.t3_prefix(specific_submission)
-        submission_ids = [specific_submission]
+        submission_cur.execute('SELECT * FROM submissions WHERE idstr == ?', [specific_submission])
+        comment_cur.execute('SELECT * FROM comments WHERE submission == ? ORDER BY created', [specific_submission])
+
+    submissions = common.fetchgenerator(submission_cur)
+    comments = common.fetchgenerator(comment_cur)
 
     found_some_posts = False
-    for submission_id in submission_ids:
+    for (submission, submission_comments) in _merge_comments(submissions, comments):
         found_some_posts = True
-        cur2.execute('SELECT * FROM submissions WHERE idstr == ?', [submission_id])
-        submission = cur2.fetchone()
-        cur2.execute('SELECT * FROM comments WHERE submission == ?', [submission_id])
-        fetched_comments = cur2.fetchall()
-        submission_tree = tree_from_submission(submission, fetched_comments)
+        submission_tree = tree_from_submission(submission, submission_comments)
         yield submission_tree
 
     if not found_some_posts:
         raise Exception('Found no submissions!')
 
+def _merge_comments(submission_dbrows, comment_dbrows):
+    '''
+    Given the rows of the submissions and of the comments, both sorted by
+    submission idstr, yield (submission row, list of its comment rows) for
+    each submission. Comments whose submission is not in the database are
+    skipped.
+    '''
+    idstr_index = tsdb.SQL_SUBMISSION['idstr']
+    submission_index = tsdb.SQL_COMMENT['submission']
+
+    comment_dbrows = iter(comment_dbrows)
+    comment = next(comment_dbrows, None)
+    for submission in submission_dbrows:
+        idstr = submission[idstr_index]
+        while comment is not None and comment[submission_index] < idstr:
+            comment = next(comment_dbrows, None)
+
+        comments = []
+        while comment is not None and comment[submission_index] == idstr:
+            comments.append(comment)
+            comment = next(comment_dbrows, None)
+
+        yield (submission, comments)
+
 def tree_from_submission(submission_dbrow, comments_dbrows):
     '''
     Given the sqlite data for a submission and all of its comments,
@@ -366,18 +392,18 @@ def tree_from_submission(submission_dbrow, comments_dbrows):
             this_node.parent = parent_node
     return tree
 
-def offline_reading(subreddit=None, username=None, specific_submission=None):
+def offline_reading(subreddit=None, username=None, specific_submission=None, pragma_profile=None):
     if not specific_submission and not common.is_xor(subreddit, username):
         raise exceptions.NotExclusive(['subreddit', 'username'])
 
     if specific_submission and not username and not subreddit:
-        database = tsdb.TSDB.for_submission(specific_submission, do_create=False)
+        database = tsdb.TSDB.for_submission(specific_submission, do_create=False, pragma_profile=pragma_profile)
 
     elif subreddit:
-        database = tsdb.TSDB.for_subreddit(subreddit, do_create=False)
+        database = tsdb.TSDB.for_subreddit(subreddit, do_create=False, pragma_profile=pragma_profile)
 
     else:
-        database = tsdb.TSDB.for_user(username, do_create=False)
+        database = tsdb.TSDB.for_user(username, do_create=False, pragma_profile=pragma_profile)
 
     htmls = html_from_database(database, specific_submission=specific_submission)
 
@@ -394,4 +420,5 @@ def offline_reading_argparse(args):
         subreddit=args.subreddit,
         username=args.username,
         specific_submission=args.specific_submission,
+        pragma_profile=args.pragma_profile,
     )
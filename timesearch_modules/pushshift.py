@@ -7,14 +7,20 @@ This module interfaces with api.pushshift.io to restore this functionality.
 It also provides new features previously impossible through reddit alone, such
 as scanning all of a user's comments.
 '''
+import asyncio
+import collections
 import html
+import json
+import os
 import requests
-import time
+import tempfile
 import traceback
 
+from . import asyncclient
 from . import common
+from . import httpcache
+from . import ratelimits
 
-from voussoirkit import ratelimiter
 from voussoirkit import vlogging
 
 log = vlogging.get_logger(__name__)
@@ -30,6 +36,25 @@ DEFAULT_PARAMS = {
     'sort': 'created_utc',
 }
 
+# The allowances per minute. When several processes share a ratelimit file,
+# these are the totals which they split between them.
+PUSHSHIFT_ALLOWANCE = 120
+REDDIT_ALLOWANCE = 100
+
+DEFAULT_SHARED_RATELIMIT_FILE = os.path.join(tempfile.gettempdir(), 'timesearch_ratelimit.db')
+
+# How many times to try each request before giving up. The waits in between
+# come from the ratelimit's backoff.
+REQUEST_RETRIES = 8
+
+# In concurrent mode, the time range is split into this many windows per
+# thread, so that one busy window doesn't hold everything up for long.
+WINDOWS_PER_WORKER = 4
+
+# When supplementing in pipelined mode, each stage may run this many chunks
+# ahead of the next one before it has to wait.
+PIPELINE_BUFFER_CHUNKS = 4
+
 # Pushshift does not supply attributes that are null. So we fill them back in.
 FALLBACK_ATTRIBUTES = {
     'distinguished': None,
@@ -51,7 +76,9 @@ useragent = USERAGENT.format(version=common.VERSION, contact=common.bot.CONTACT_
 ratelimit = None
 session = requests.Session()
 session.headers.update({'User-Agent': useragent})
-ratelimit = ratelimiter.Ratelimiter(allowance=120, period=60)
+ratelimit = ratelimits.AdaptiveRatelimiter(allowance=PUSHSHIFT_ALLOWANCE, period=60)
+async_client = None
+http_cache = None
 
 class DummyObject:
     '''
@@ -110,7 +137,149 @@ def _normalize_user(user):
     else:
         return user.name
 
-def _pagination_core(url, params, dummy_type, lower=None, upper=None):
+def _time_windows(lower, upper, count):
+    '''
+    Split the integer timestamps lower <= t < upper into at most `count`
+    consecutive (start, end) windows, which together cover the range exactly
+    once.
+    '''
+    step = max(1, -(-(upper - lower) // count))
+    boundaries = list(range(lower, upper, step)) + [upper]
+    return list(zip(boundaries, boundaries[1:]))
+
+def _pagination_concurrent(url, params, dummy_type, lower, upper, concurrency):
+    '''
+    Split the time range into windows and page through several of them at
+    once on the async client, sharing the global ratelimit. The windows are
+    yielded in order, so the items still come out sorted by created_utc.
+
+    Pushshift's after and before are both exclusive. A window (start, end)
+    asks for after=start-1 and before=end, which means start <= t < end, so
+    items sharing a timestamp at the boundary belong to exactly one window.
+    '''
+    lower = 0 if lower is None else int(lower)
+    upper = common.get_now() + 1 if upper is None else int(upper)
+    # The overall range is lower < t < upper.
+    windows = _time_windows(lower + 1, upper, count=concurrency * WINDOWS_PER_WORKER)
+    log.debug('Splitting %s into %d windows.', url, len(windows))
+
+    def pages():
+        loop = asyncio.new_event_loop()
+        window_pages = _pagination_pages(url, params, dummy_type, windows, concurrency)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(window_pages.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(window_pages.aclose())
+            loop.close()
+
+    # The event loop runs on its own thread, so the windows keep downloading
+    # while the caller is busy with the pages we've already yielded, until
+    # the buffer is full.
+    for page in common.threaded_generator(pages(), buffer_size=PIPELINE_BUFFER_CHUNKS):
+        yield from page
+
+async def _pagination_pages(url, params, dummy_type, windows, concurrency):
+    '''
+    Page through `concurrency` windows at a time, and yield the pages of the
+    oldest window while the others download. Each window holds at most
+    PIPELINE_BUFFER_CHUNKS pages before it waits for us to catch up with it,
+    so memory doesn't grow with the size of the windows.
+    '''
+    done = object()
+
+    async def fill(window_queue, start, end):
+        try:
+            async for page in _pagination_window(url, params, dummy_type, lower=start - 1, upper=end):
+                await window_queue.put(page)
+        except Exception as exc:
+            await window_queue.put(exc)
+        else:
+            await window_queue.put(done)
+
+    windows = iter(windows)
+    in_flight = collections.deque()
+
+    def start_next_window():
+        for (start, end) in windows:
+            window_queue = asyncio.Queue(maxsize=PIPELINE_BUFFER_CHUNKS)
+            task = asyncio.get_running_loop().create_task(fill(window_queue, start, end))
+            in_flight.append((window_queue, task))
+            return
+
+    try:
+        for x in range(concurrency):
+            start_next_window()
+
+        while in_flight:
+            (window_queue, task) = in_flight[0]
+            while True:
+                page = await window_queue.get()
+                if page is done:
+                    break
+                if isinstance(page, Exception):
+                    raise page
+                yield page
+            in_flight.popleft()
+            start_next_window()
+    finally:
+        for (window_queue, task) in in_flight:
+            task.cancel()
+        if in_flight:
+            await asyncio.gather(*(task for (window_queue, task) in in_flight), return_exceptions=True)
+
+async def _pagination_window(url, params, dummy_type, lower, upper):
+    '''
+    The async counterpart of _pagination_core for a single window, yielding
+    each page of new items as a list.
+    '''
+    params = dict(params)
+    params['before'] = upper
+    params['after'] = lower
+
+    prev_batch_ids = set()
+    while True:
+        for retry in range(REQUEST_RETRIES):
+            try:
+                batch = await get_async(url, params)
+            except requests.exceptions.RequestException as exc:
+                if retry == REQUEST_RETRIES - 1:
+                    raise
+                traceback.print_exc()
+                # The next request waits on the ratelimit until it's time.
+                delay = ratelimit.failure(exc.response)
+                print(f'Retrying in {delay:.1f}...')
+            else:
+                break
+
+        log.debug('Got batch of %d items.', len(batch))
+        items = _new_items(batch, prev_batch_ids, dummy_type)
+        if not items:
+            break
+        params['after'] = items[-1].created_utc - 1
+        yield items
+        prev_batch_ids = set(item['id'] for item in batch)
+
+def _new_items(batch, prev_batch_ids, dummy_type):
+    '''
+    Return the items of this page that we didn't already get from the
+    previous page, sorted by created_utc. An empty list means we're done.
+    '''
+    batch_ids = set(item['id'] for item in batch)
+    if len(batch_ids) == 0 or batch_ids.issubset(prev_batch_ids):
+        return []
+    items = [dummy_type(**x) for x in batch if x['id'] not in prev_batch_ids]
+    items.sort(key=lambda x: x.created_utc)
+    return items
+
+def _pagination_core(url, params, dummy_type, lower=None, upper=None, concurrency=None):
+    if concurrency is not None and concurrency > 1:
+        yield from _pagination_concurrent(url, params, dummy_type, lower, upper, concurrency)
+        return
+
     if upper is not None:
         params['before'] = upper
     if lower is not None:
@@ -120,33 +289,34 @@ def _pagination_core(url, params, dummy_type, lower=None, upper=None):
     prev_batch_ids = set()
 
     while True:
-        for retry in range(5):
+        for retry in range(REQUEST_RETRIES):
             try:
                 batch = get(url, params)
-            except requests.exceptions.HTTPError as exc:
+            except requests.exceptions.RequestException as exc:
+                if retry == REQUEST_RETRIES - 1:
+                    raise
                 traceback.print_exc()
-                print('Retrying in 5...')
-                time.sleep(5)
+                # The next request waits on the ratelimit until it's time.
+                delay = ratelimit.failure(exc.response)
+                print(f'Retrying in {delay:.1f}...')
             else:
                 break
 
         log.debug('Got batch of %d items.', len(batch))
-        batch_ids = setify(batch)
-        if len(batch_ids) == 0 or batch_ids.issubset(prev_batch_ids):
+        submissions = _new_items(batch, prev_batch_ids, dummy_type)
+        if not submissions:
             break
-        submissions = [dummy_type(**x) for x in batch if x['id'] not in prev_batch_ids]
-        submissions.sort(key=lambda x: x.created_utc)
         # Take the latest-1 to avoid the lightning strike chance that two posts
         # have the same timestamp and this occurs at a page boundary.
         # Since ?after=latest would cause us to miss that second one.
         params['after'] = submissions[-1].created_utc - 1
         yield from submissions
 
-        prev_batch_ids = batch_ids
+        prev_batch_ids = setify(batch)
         ratelimit.limit()
 
-def get(url, params=None):
-    if not url.startswith('https://'):
+def _prepare_request(url, params):
+    if not url.startswith(('https://', 'http://')):
         url = API_URL + url.lstrip('/')
 
     if params is None:
@@ -155,14 +325,116 @@ def get(url, params=None):
     for (key, val) in DEFAULT_PARAMS.items():
         params.setdefault(key, val)
 
-    log.debug('Requesting %s with %s', url, params)
-    ratelimit.limit()
-    response = session.get(url, params=params)
-    response.raise_for_status()
-    response = response.json()
+    return (url, params)
+
+def get(url, params=None):
+    (url, params) = _prepare_request(url, params)
+    body = None if http_cache is None else http_cache.get(url, params)
+    if body is None:
+        log.debug('Requesting %s with %s', url, params)
+        ratelimit.limit()
+        response = session.get(url, params=params)
+        ratelimit.observe(response)
+        response.raise_for_status()
+        body = response.content
+        if http_cache is not None:
+            http_cache.put(url, params, body)
+    response = json.loads(body)
+    data = response['data']
+    return data
+
+async def get_async(url, params=None):
+    (url, params) = _prepare_request(url, params)
+    client = get_async_client()
+    # The cache does blocking disk and SQLite work, so it runs on the
+    # client's executor like the requests do, instead of on the event loop.
+    loop = asyncio.get_running_loop()
+    if http_cache is None:
+        body = None
+    else:
+        body = await loop.run_in_executor(client.executor, http_cache.get, url, params)
+    if body is None:
+        response = await client.get(url, params=params)
+        body = response.content
+        if http_cache is not None:
+            await loop.run_in_executor(client.executor, http_cache.put, url, params, body)
+    response = json.loads(body)
     data = response['data']
     return data
 
+def get_async_client():
+    '''
+    Return the AsyncClient used for concurrent requests, creating it the first
+    time. It spends from the same ratelimit as the blocking session.
+    '''
+    global async_client
+    if async_client is None:
+        async_client = asyncclient.AsyncClient(
+            headers={'User-Agent': useragent},
+            ratelimit=asyncclient.AsyncRatelimiter(ratelimit),
+        )
+    return async_client
+
+def use_http_cache(directory, **kwargs):
+    '''
+    Keep the responses of all pushshift requests in an httpcache.ResponseCache
+    at this directory. kwargs go to the ResponseCache.
+    '''
+    global http_cache
+    http_cache = httpcache.ResponseCache(directory, **kwargs)
+    return http_cache
+
+def use_http_cache_argparse(args):
+    if args.http_cache is None:
+        return None
+
+    if args.http_cache_size is None:
+        max_size = httpcache.DEFAULT_MAX_SIZE
+    else:
+        max_size = int(float(args.http_cache_size) * 2**20)
+
+    return use_http_cache(args.http_cache, max_size=max_size, replay_only=args.replay_only)
+
+def use_shared_ratelimit(filepath=None, share=1):
+    '''
+    Replace the pushshift ratelimit, and set common.reddit_ratelimit, with
+    ratelimits.SharedRatelimiter so that all the timesearch processes using
+    this file split one budget. share is this process's weight in the split.
+    '''
+    global async_client
+    global ratelimit
+    if filepath is None:
+        filepath = DEFAULT_SHARED_RATELIMIT_FILE
+
+    ratelimit = ratelimits.SharedRatelimiter(
+        filepath,
+        'pushshift',
+        allowance=PUSHSHIFT_ALLOWANCE,
+        period=60,
+        share=share,
+    )
+    common.reddit_ratelimit = ratelimits.SharedRatelimiter(
+        filepath,
+        'reddit',
+        allowance=REDDIT_ALLOWANCE,
+        period=60,
+        share=share,
+    )
+
+    # The async client was holding on to the old ratelimit.
+    if async_client is not None:
+        async_client.close()
+        async_client = None
+    return ratelimit
+
+def use_shared_ratelimit_argparse(args):
+    if args.shared_ratelimit is None:
+        return None
+
+    share = 1 if args.ratelimit_share is None else float(args.ratelimit_share)
+    filepath = args.shared_ratelimit or None
+    return use_shared_ratelimit(filepath, share=share)
+
 def get_comments_from_submission(submission):
     if isinstance(submission, str):
         submission_id = common.t3_prefix(submission)[3:]
@@ -221,7 +493,7 @@ def get_submissions_from_user(user, **kwargs):
     )
     yield from submissions
 
-def supplement_reddit_data(dummies, chunk_size=100):
+def supplement_reddit_data(dummies, chunk_size=100, pipelined=False, skip=None):
     '''
     Given an iterable of the Dummy Pushshift objects, yield them back and also
     yield the live Reddit objects they refer to according to reddit's /api/info.
@@ -229,12 +501,41 @@ def supplement_reddit_data(dummies, chunk_size=100):
     By doing this, we enjoy the strengths of both data sources: Pushshift
     will give us deleted or removed objects that reddit would not, and reddit
     gives us up-to-date scores and text bodies.
+
+    pipelined:
+        If True, the pushshift paging and the reddit requests each run on
+        their own thread, connected by bounded queues. Then pushshift, reddit,
+        and the caller's database inserts all make progress at the same time
+        instead of waiting on each other.
+
+    skip:
+        An optional function that takes a list of fullnames and returns the set
+        of them that do not need live data, such as TSDB.get_fresh_fullnames.
+        Those items are already in the database and fresh, so neither copy of
+        them is yielded, because the pushshift copy would overwrite the newer
+        score.
     '''
+    if pipelined:
+        buffer_size = chunk_size * PIPELINE_BUFFER_CHUNKS
+        dummies = common.threaded_generator(dummies, buffer_size=buffer_size)
+        supplemented = supplement_reddit_data(dummies, chunk_size=chunk_size, skip=skip)
+        yield from common.threaded_generator(supplemented, buffer_size=buffer_size)
+        return
+
     chunks = common.generator_chunker(dummies, chunk_size)
     for chunk in chunks:
+        if skip is not None:
+            fresh = skip([item.fullname for item in chunk])
+            if fresh:
+                log.debug('Skipping %d fresh items.', len(fresh))
+                chunk = [item for item in chunk if item.fullname not in fresh]
+            if not chunk:
+                continue
+
         log.debug('Supplementing %d items with live reddit data.', len(chunk))
         ids = [item.fullname for item in chunk]
-        live_copies = list(common.r.info(ids))
+        common.limit_reddit()
+        live_copies = list(common.r.info(fullnames=ids))
         live_copies = {item.fullname: item for item in live_copies}
         for item in chunk:
             yield item
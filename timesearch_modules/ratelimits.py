@@ -0,0 +1,289 @@
+'''
+A ratelimiter that adapts to what the server tells us, instead of trusting a
+fixed allowance.
+
+- When a response carries X-Ratelimit-Remaining and X-Ratelimit-Reset headers,
+  the allowance is lowered to whatever rate spends the remaining requests
+  evenly until the reset.
+- When a request fails, every user of the limiter pauses for Retry-After if
+  the server sent one, or else for an exponential backoff with jitter. A 429
+  also halves the allowance.
+- Every successful response earns back a little of the allowance, up to the
+  original, so we speed up again once the errors stop.
+
+The SharedRatelimiter also splits its allowance with the other timesearch
+processes on the same machine.
+'''
+import email.utils
+import os
+import random
+import socket
+import sqlite3
+import time
+
+from voussoirkit import backoff
+from voussoirkit import pathclass
+from voussoirkit import ratelimiter
+from voussoirkit import vlogging
+
+log = vlogging.get_logger(__name__)
+
+# Used to tell apart a reset given as "seconds from now" and one given as a
+# unix timestamp.
+RESET_IS_TIMESTAMP = 10**9
+
+def jitter(seconds):
+    '''
+    Randomize the delay so that several clients who failed at the same moment
+    don't all come back at the same moment too. Keeping at least half of the
+    delay makes sure we still back off.
+    '''
+    return seconds * random.uniform(0.5, 1.0)
+
+def retry_after(response):
+    '''
+    Return the number of seconds the server asked us to wait with the
+    Retry-After header, which may be a number of seconds or an HTTP date, or
+    None if it didn't.
+    '''
+    if response is None:
+        return None
+
+    value = response.headers.get('Retry-After', None)
+    if value is None:
+        return None
+
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, date.timestamp() - time.time())
+
+class AdaptiveRatelimiter(ratelimiter.Ratelimiter):
+    def __init__(
+            self,
+            allowance,
+            *,
+            period=1,
+            max_backoff=300,
+            min_allowance=None,
+            recovery=1,
+            **kwargs,
+        ):
+        '''
+        allowance, period:
+            The best case rate, which we start at and never go above.
+
+        max_backoff:
+            The longest we'll wait after a failure, in seconds, unless the
+            server asks for longer with Retry-After.
+
+        min_allowance:
+            The lowest the allowance can be cut to by failures. Default is
+            one twentieth of the allowance.
+
+        recovery:
+            How much of the allowance every successful response earns back.
+        '''
+        super().__init__(allowance, period=period, **kwargs)
+        self.max_allowance = allowance
+        self.min_allowance = allowance / 20 if min_allowance is None else min_allowance
+        self.recovery = recovery
+        self.backoff = backoff.Exponential(a=2, b=1, max=max_backoff)
+        self.blocked_until = 0
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(allowance={self.allowance}, period={self.period})'
+
+    def _limit(self, cost):
+        (success, sleep_needed) = super()._limit(cost)
+        blocked = self.blocked_until - time.monotonic()
+        return (success, max(sleep_needed, blocked))
+
+    def _set_allowance(self, allowance):
+        allowance = min(self.max_allowance, max(self.min_allowance, allowance))
+        if allowance != self.allowance:
+            log.debug('Changing allowance from %s to %s per %ss.', self.allowance, allowance, self.period)
+        self.allowance = allowance
+
+    def _read_headers(self, response):
+        try:
+            remaining = float(response.headers['X-Ratelimit-Remaining'])
+            reset = float(response.headers['X-Ratelimit-Reset'])
+        except (KeyError, ValueError):
+            return
+
+        if reset > RESET_IS_TIMESTAMP:
+            reset -= time.time()
+        reset = max(reset, 1)
+
+        if remaining < 1:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + reset)
+            return
+
+        sustainable = remaining / reset * self.period
+        if sustainable < self.allowance:
+            self._set_allowance(sustainable)
+
+    def observe(self, response):
+        '''
+        Call this with every response we get, before raising for its status.
+        '''
+        with self.lock:
+            if response.ok:
+                self.backoff.reset()
+                self._set_allowance(self.allowance + self.recovery)
+            self._read_headers(response)
+
+    def failure(self, response=None):
+        '''
+        Call this when a request fails, with its response if there was one.
+        Every caller of limit will wait until we're ready to try again.
+        Return the number of seconds until then.
+        '''
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                # Another request already failed during this outage, so we're
+                # already backing off. Don't compound it.
+                return self.blocked_until - now
+
+            delay = jitter(self.backoff.next())
+            requested = retry_after(response)
+            if requested is not None:
+                delay = max(delay, requested)
+
+            if response is not None and response.status_code == 429:
+                self._set_allowance(self.allowance / 2)
+
+            self.blocked_until = now + delay
+            return delay
+
+SHARED_INIT = '''
+CREATE TABLE IF NOT EXISTS members(
+    bucket TEXT,
+    member TEXT,
+    share REAL,
+    seen_at REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS members_index ON members(bucket, member);
+CREATE TABLE IF NOT EXISTS blocks(
+    bucket TEXT PRIMARY KEY,
+    blocked_until REAL
+);
+'''
+
+# A process that hasn't asked the shared ratelimiter for anything in this many
+# seconds no longer counts towards the split, so its share goes to the others.
+MEMBER_TIMEOUT = 60
+
+# Check in with the other processes at most this often, in seconds, or at
+# most once per request's worth of time if that's shorter, unless we have a
+# new backoff deadline to tell them about. Each check in is a write
+# transaction on the shared file, so we don't want one on every request, but
+# a process that checks in rarely could spend more than its share meanwhile.
+SYNC_INTERVAL = 1
+
+class SharedRatelimiter(AdaptiveRatelimiter):
+    '''
+    An AdaptiveRatelimiter whose allowance is split between all of the
+    timesearch processes on this machine that use the same file and bucket
+    name. The file is a small SQLite database, because SQLite already knows
+    how to lock a file between processes on every platform.
+
+    Each process gets share / (sum of the shares of the active processes) of
+    the allowance. When one process is told to back off, the others wait too.
+    '''
+    def __init__(self, filepath, bucket, allowance, *, share=1, **kwargs):
+        super().__init__(allowance, **kwargs)
+        self.filepath = pathclass.Path(filepath)
+        self.filepath.parent.makedirs(exist_ok=True)
+        self.bucket = bucket
+        self.share = share
+        self.member = f'{socket.gethostname()}:{os.getpid()}:{id(self)}'
+        self.fraction = 1
+        self.synced_at = None
+        self.shared_blocked_until = 0
+
+        self.sql = sqlite3.connect(self.filepath.absolute_path, isolation_level=None, check_same_thread=False)
+        self.sql.execute('PRAGMA busy_timeout = 10000')
+        self.sql.executescript(SHARED_INIT)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.filepath.absolute_path}, {self.bucket}, share={self.share})'
+
+    @property
+    def gain_rate(self):
+        return self.allowance * self.fraction / self.period
+
+    def _sync(self):
+        '''
+        Check in with the other processes: refresh our membership, find out
+        our fraction of the allowance, and exchange backoff deadlines. The
+        deadlines are stored in wall clock time, since monotonic clocks are
+        not comparable between processes.
+        '''
+        now = time.time()
+        cur = self.sql.cursor()
+        cur.execute('BEGIN IMMEDIATE')
+        try:
+            cur.execute(
+                'INSERT INTO members VALUES(?, ?, ?, ?) ON CONFLICT(bucket, member) DO UPDATE SET share = excluded.share, seen_at = excluded.seen_at',
+                [self.bucket, self.member, self.share, now],
+            )
+            cur.execute('DELETE FROM members WHERE bucket == ? AND seen_at < ?', [self.bucket, now - MEMBER_TIMEOUT])
+            cur.execute('SELECT SUM(share) FROM members WHERE bucket == ?', [self.bucket])
+            total_shares = cur.fetchone()[0]
+            self.fraction = self.share / total_shares
+
+            ours = self.blocked_until - time.monotonic() + now
+            cur.execute(
+                'INSERT INTO blocks VALUES(?, ?) ON CONFLICT(bucket) DO UPDATE SET blocked_until = max(blocked_until, excluded.blocked_until)',
+                [self.bucket, ours],
+            )
+            cur.execute('SELECT blocked_until FROM blocks WHERE bucket == ?', [self.bucket])
+            theirs = cur.fetchone()[0]
+            cur.execute('COMMIT')
+        except Exception:
+            cur.execute('ROLLBACK')
+            raise
+
+        self.blocked_until = max(self.blocked_until, theirs - now + time.monotonic())
+        self.shared_blocked_until = self.blocked_until
+        self.synced_at = time.monotonic()
+
+    def _limit(self, cost):
+        # This is Ratelimiter._limit, except that the balance is capped at our
+        # fraction of the allowance, so that several processes which were
+        # idle can't all burst at once.
+        now = time.monotonic()
+        sync_interval = min(SYNC_INTERVAL, self.period / self.max_allowance)
+        stale = self.synced_at is None or now - self.synced_at >= sync_interval
+        if stale or self.blocked_until > self.shared_blocked_until:
+            self._sync()
+        now = time.monotonic()
+        time_diff = now - self.last_operation
+        self.balance += time_diff * self.gain_rate
+        self.balance = min(self.balance, self.allowance * self.fraction)
+        self.last_operation = now
+
+        if self.mode is ratelimiter.REJECT and self.balance < cost:
+            return (False, 0)
+
+        self.balance -= cost
+        if self.balance >= 0:
+            sleep_needed = 0
+        else:
+            sleep_needed = abs(self.balance) / self.gain_rate
+
+        blocked = self.blocked_until - now
+        return (True, max(sleep_needed, blocked))
+
+    def close(self):
+        self.sql.execute('DELETE FROM members WHERE bucket == ? AND member == ?', [self.bucket, self.member])
+        self.sql.close()
@@ -0,0 +1,182 @@
+'''
+Update the scores, comment counts, and edited text of the items already in a
+database, by asking reddit's /api/info for their live copies. This does not
+need pushshift at all.
+'''
+import collections
+import concurrent.futures
+
+from . import common
+from . import exceptions
+from . import pushshift
+from . import ratelimits
+from . import tsdb
+
+from voussoirkit import vlogging
+
+log = vlogging.get_logger(__name__)
+
+# /api/info accepts at most this many fullnames per request.
+INFO_CHUNK_SIZE = 100
+
+# The number of /api/info requests that may be in flight or waiting for the
+# database while it writes the previous response.
+PREFETCH_CHUNKS = 4
+
+def _select_fullnames(database, tables, lower, upper, refresh_ttl):
+    '''
+    Return the number of items to refresh, and a generator of their fullnames
+    in order of creation, which reads them from the database as it goes.
+    '''
+    conditions = []
+    bindings = []
+    if lower is not None:
+        conditions.append('created >= ?')
+        bindings.append(lower)
+    if upper is not None:
+        conditions.append('created < ?')
+        bindings.append(upper)
+    if refresh_ttl is not None:
+        conditions.append('(refreshed_at IS NULL OR refreshed_at < ?)')
+        bindings.append(common.get_now() - refresh_ttl)
+
+    if conditions:
+        where = 'WHERE ' + ' AND '.join(conditions)
+    else:
+        where = ''
+
+    bindings = bindings * len(tables)
+    cur = database.sql.cursor()
+
+    counts = [f'SELECT COUNT(*) FROM {table} {where}' for table in tables]
+    cur.execute('SELECT ' + ' + '.join(f'({count})' for count in counts), bindings)
+    total = cur.fetchone()[0]
+
+    # The refreshes only rewrite rows that this query has already returned,
+    # and never their created, so they don't disturb it while it is read.
+    selects = [f'SELECT idstr, created FROM {table} {where}' for table in tables]
+    query = ' UNION ALL '.join(selects) + ' ORDER BY created'
+    cur = database.sql.cursor()
+    cur.execute(query, bindings)
+    fullnames = (idstr for (idstr, created) in common.fetchgenerator(cur))
+    return (total, fullnames)
+
+def refresh(
+        subreddit=None,
+        username=None,
+        do_submissions=True,
+        do_comments=True,
+        lower=None,
+        upper=None,
+        min_age=None,
+        max_age=None,
+        refresh_ttl=None,
+        pragma_profile=None,
+        workers=1,
+    ):
+    '''
+    lower, upper:
+        Only refresh items created in this range of unix timestamps.
+
+    min_age, max_age:
+        Only refresh items that are between this many seconds old. These are
+        combined with lower and upper.
+
+    refresh_ttl:
+        Skip items that were already refreshed within this many seconds.
+
+    workers:
+        The number of /api/info requests to make at the same time. Each
+        worker thread has its own Reddit instance, and they share one
+        ratelimit. The inserts all happen on the calling thread.
+    '''
+    if not common.is_xor(subreddit, username):
+        raise exceptions.NotExclusive(['subreddit', 'username'])
+
+    if not any([do_submissions, do_comments]):
+        raise TypeError('Required do_submissions and/or do_comments parameter')
+
+    common.login()
+
+    if subreddit:
+        database = tsdb.TSDB.for_subreddit(subreddit, do_create=False, pragma_profile=pragma_profile)
+    else:
+        database = tsdb.TSDB.for_user(username, do_create=False, pragma_profile=pragma_profile)
+
+    now = common.get_now()
+    if max_age is not None:
+        lower = max(lower or 0, now - max_age)
+    if min_age is not None:
+        upper = now - min_age if upper is None else min(upper, now - min_age)
+
+    tables = []
+    if do_submissions:
+        tables.append('submissions')
+    if do_comments:
+        tables.append('comments')
+
+    (total, fullnames) = _select_fullnames(database, tables, lower=lower, upper=upper, refresh_ttl=refresh_ttl)
+    print(f'Refreshing {total} items in {database.filepath.basename}.')
+
+    if common.reddit_ratelimit is None:
+        # Each worker has its own PRAW instance with its own ratelimit, so
+        # they need one in common to stay within reddit's limit together.
+        common.reddit_ratelimit = ratelimits.AdaptiveRatelimiter(
+            allowance=pushshift.REDDIT_ALLOWANCE,
+            period=60,
+        )
+
+    def fetch_live_copies(chunk):
+        log.debug('Getting live copies of %d items.', len(chunk))
+        common.limit_reddit()
+        reddit = common.thread_reddit()
+        return (len(chunk), list(reddit.info(fullnames=chunk)))
+
+    def live_chunks(executor):
+        # Keep a few requests in flight ahead of the database, and yield
+        # their results in order.
+        chunks = common.generator_chunker(fullnames, INFO_CHUNK_SIZE)
+        in_flight = collections.deque()
+        for chunk in chunks:
+            in_flight.append(executor.submit(fetch_live_copies, chunk))
+            if len(in_flight) >= max(workers, PREFETCH_CHUNKS):
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+    done = 0
+    form = '{done}/{total} {lower} - {upper}'
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='refresh') as executor:
+        for (asked, live_items) in live_chunks(executor):
+            done += asked
+            if not live_items:
+                continue
+            database.insert(live_items)
+            message = form.format(
+                done=done,
+                total=total,
+                lower=common.human(live_items[0].created_utc),
+                upper=common.human(live_items[-1].created_utc),
+            )
+            print(message)
+
+def refresh_argparse(args):
+    pushshift.use_shared_ratelimit_argparse(args)
+
+    if args.submissions is args.comments is False:
+        args.submissions = True
+        args.comments = True
+
+    return refresh(
+        subreddit=args.subreddit,
+        username=args.username,
+        do_submissions=args.submissions,
+        do_comments=args.comments,
+        lower=common.int_none(args.lower),
+        upper=common.int_none(args.upper),
+        min_age=common.int_none(args.min_age),
+        max_age=common.int_none(args.max_age),
+        refresh_ttl=common.int_none(args.refresh_ttl),
+        pragma_profile=args.pragma_profile,
+        workers=int(args.workers),
+    )
@@ -1,5 +1,6 @@
 import os
 import sqlite3
+import threading
 import time
 import types
 
@@ -31,16 +32,57 @@ DB_FORMATS_USER = [
     '.\\users\\@{name}\\@{name}.db',
 ]
 
-DATABASE_VERSION = 2
+DATABASE_VERSION = 7
 DB_VERSION_PRAGMA = f'''
 PRAGMA user_version = {DATABASE_VERSION};
 '''
 
-DB_PRAGMAS = f'''
-'''
+# Each database remembers its pragma profile in the config table. You can pick
+# a different one by passing pragma_profile to TSDB, which will also store it
+# as the new default for that database.
+PRAGMA_PROFILES = {
+    # Plain SQLite defaults: rollback journal and full durability.
+    'default': {
+        'busy_timeout': 5000,
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+    },
+    # Maximum throughput for ingesting archives and big backfills. A power
+    # loss may corrupt the database, but you can always ingest it again.
+    'bulk-ingest': {
+        'busy_timeout': 10000,
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -262144,
+        'mmap_size': 2**30,
+        'temp_store': 'MEMORY',
+    },
+    # Long-running processes that make small, frequent commits while other
+    # processes may be reading the database.
+    'livestream': {
+        'busy_timeout': 30000,
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -16000,
+        'mmap_size': 2**28,
+        'temp_store': 'MEMORY',
+    },
+    # offline_reading, index, and breakdown mostly read big chunks of the
+    # database and barely write.
+    'reporting': {
+        'busy_timeout': 30000,
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -262144,
+        'mmap_size': 2**30,
+        'temp_store': 'MEMORY',
+    },
+}
 
 DB_INIT = f'''
-{DB_PRAGMAS}
 {DB_VERSION_PRAGMA}
 ----------------------------------------------------------------------------------------------------
 CREATE TABLE IF NOT EXISTS config(
@@ -66,9 +108,12 @@ CREATE TABLE IF NOT EXISTS submissions(
     flair_text TEXT,
     flair_css_class TEXT,
     augmented_at INT,
-    augmented_count INT
+    augmented_count INT,
+    refreshed_at INT
 );
-CREATE INDEX IF NOT EXISTS submission_index ON submissions(idstr);
+CREATE UNIQUE INDEX IF NOT EXISTS submission_index ON submissions(idstr);
+CREATE UNIQUE INDEX IF NOT EXISTS submission_idint_index ON submissions(idint);
+CREATE INDEX IF NOT EXISTS submission_created_index ON submissions(created);
 ----------------------------------------------------------------------------------------------------
 CREATE TABLE IF NOT EXISTS comments(
     idint INT,
@@ -81,9 +126,13 @@ CREATE TABLE IF NOT EXISTS comments(
     score INT,
     subreddit TEXT,
     distinguish TEXT,
-    textlen INT
+    textlen INT,
+    refreshed_at INT
 );
-CREATE INDEX IF NOT EXISTS comment_index ON comments(idstr);
+CREATE UNIQUE INDEX IF NOT EXISTS comment_index ON comments(idstr);
+CREATE UNIQUE INDEX IF NOT EXISTS comment_idint_index ON comments(idint);
+CREATE INDEX IF NOT EXISTS comment_created_index ON comments(created);
+CREATE INDEX IF NOT EXISTS comment_submission_index ON comments(submission, created);
 ----------------------------------------------------------------------------------------------------
 CREATE TABLE IF NOT EXISTS submission_edits(
     idstr TEXT,
@@ -98,10 +147,37 @@ CREATE TABLE IF NOT EXISTS comment_edits(
     replaced_at INT
 );
 CREATE INDEX IF NOT EXISTS comment_edits_index ON comment_edits(idstr);
+----------------------------------------------------------------------------------------------------
+-- The created timestamp up to which a scan of this source and kind has been
+-- completed, so that --lower update does not need to search the data tables.
+CREATE TABLE IF NOT EXISTS sync_state(
+    source TEXT,
+    kind TEXT,
+    created INT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS sync_state_index ON sync_state(source, kind);
+----------------------------------------------------------------------------------------------------
+-- How far ingest_jsonfile has committed into each input file, as an offset of
+-- the uncompressed data. file_id comes from ingest_jsonfile.file_identity.
+CREATE TABLE IF NOT EXISTS ingest_checkpoints(
+    file_id TEXT,
+    filepath TEXT,
+    offset INT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ingest_checkpoints_index ON ingest_checkpoints(file_id);
+'''
+
+# These indices only speed up the author and score sorts of the index module,
+# and they make every insert a little slower, so they are not part of DB_INIT.
+# Use TSDB.create_optional_indices if you want them.
+OPTIONAL_INDICES = '''
+CREATE INDEX IF NOT EXISTS submission_author_index ON submissions(author);
+CREATE INDEX IF NOT EXISTS submission_score_index ON submissions(score);
 '''
 
 DEFAULT_CONFIG = {
     'store_edits': True,
+    'pragma_profile': 'default',
 }
 
 SQL_SUBMISSION_COLUMNS = [
@@ -123,6 +199,7 @@ SQL_SUBMISSION_COLUMNS = [
     'flair_css_class',
     'augmented_at',
     'augmented_count',
+    'refreshed_at',
 ]
 
 SQL_COMMENT_COLUMNS = [
@@ -137,6 +214,7 @@ SQL_COMMENT_COLUMNS = [
     'subreddit',
     'distinguish',
     'textlen',
+    'refreshed_at',
 ]
 
 SQL_EDITS_COLUMNS = [
@@ -145,9 +223,70 @@ SQL_EDITS_COLUMNS = [
     'replaced_at',
 ]
 
+# When an item already exists, these are the columns that get refreshed from
+# the newer copy. A value of None keeps whatever is already stored.
+UPDATE_COLUMNS = {
+    'submissions': [
+        'nsfw',
+        'score',
+        'selftext',
+        'distinguish',
+        'num_comments',
+        'flair_text',
+        'flair_css_class',
+        'refreshed_at',
+    ],
+    'comments': [
+        'score',
+        'body',
+        'distinguish',
+        'refreshed_at',
+    ],
+}
+
+def _upsert_query(table, columns):
+    column_names = ', '.join(columns)
+    qmarks = ', '.join('?' * len(columns))
+    setters = ',\n'.join(f'{column} = coalesce(excluded.{column}, {column})' for column in UPDATE_COLUMNS[table])
+    query = f'''
+    INSERT INTO {table} ({column_names}) VALUES ({qmarks})
+    ON CONFLICT(idstr) DO UPDATE SET
+    {setters}
+    '''
+    return query
+
+UPSERT_QUERIES = {
+    'submissions': _upsert_query('submissions', SQL_SUBMISSION_COLUMNS),
+    'comments': _upsert_query('comments', SQL_COMMENT_COLUMNS),
+}
+
+# TSDB.insert looks up existing rows for this many objects at a time.
+INSERT_CHUNK_SIZE = 500
+
 SQL_SUBMISSION = {key:index for (index, key) in enumerate(SQL_SUBMISSION_COLUMNS)}
 SQL_COMMENT = {key:index for (index, key) in enumerate(SQL_COMMENT_COLUMNS)}
 
+SQL_COLUMNS = {
+    'submissions': SQL_SUBMISSION_COLUMNS,
+    'comments': SQL_COMMENT_COLUMNS,
+}
+SQL_COLUMN_INDEX = {
+    'submissions': SQL_SUBMISSION,
+    'comments': SQL_COMMENT,
+}
+TEXT_COLUMNS = {
+    'submissions': 'selftext',
+    'comments': 'body',
+}
+EDITS_TABLES = {
+    'submissions': ('submission_edits', 'previous_selftext'),
+    'comments': ('comment_edits', 'previous_body'),
+}
+NEW_COUNT_KEYS = {
+    'submissions': 'new_submissions',
+    'comments': 'new_comments',
+}
+
 SUBMISSION_TYPES = (common.praw.models.Submission, pushshift.DummySubmission)
 COMMENT_TYPES = (common.praw.models.Comment, pushshift.DummyComment)
 
@@ -175,7 +314,7 @@ class DBEntry:
 
 
 class TSDB:
-    def __init__(self, filepath, *, do_create=True, skip_version_check=False):
+    def __init__(self, filepath, *, do_create=True, skip_version_check=False, pragma_profile=None):
         self.filepath = pathclass.Path(filepath)
         if not self.filepath.is_file:
             if not do_create:
@@ -193,26 +332,21 @@ class TSDB:
         existing_database = self.filepath.exists
         self.sql = sqlite3.connect(self.filepath.absolute_path)
         self.cur = self.sql.cursor()
+        self._reader = None
+        self._reader_lock = threading.Lock()
 
         if existing_database:
             if not skip_version_check:
                 self._check_version()
-            self._load_pragmas()
         else:
             self._first_time_setup()
 
-        self.config = {}
-        for (key, default_value) in DEFAULT_CONFIG.items():
-            self.cur.execute('SELECT value FROM config WHERE key == ?', [key])
-            existing_value = self.cur.fetchone()
-            if existing_value is None:
-                self.cur.execute('INSERT INTO config VALUES(?, ?)', [key, default_value])
-                self.config[key] = default_value
-            else:
-                existing_value = existing_value[0]
-                if isinstance(default_value, int):
-                    existing_value = int(existing_value)
-                self.config[key] = existing_value
+        self._load_config()
+
+        if pragma_profile is None:
+            self._load_pragmas()
+        else:
+            self.set_pragma_profile(pragma_profile)
 
     def _check_version(self):
         '''
@@ -231,13 +365,58 @@ class TSDB:
         self.sql.executescript(DB_INIT)
         self.sql.commit()
 
+    def _load_config(self):
+        self.config = {}
+        for (key, default_value) in DEFAULT_CONFIG.items():
+            self.cur.execute('SELECT value FROM config WHERE key == ?', [key])
+            existing_value = self.cur.fetchone()
+            if existing_value is None:
+                self.cur.execute('INSERT INTO config VALUES(?, ?)', [key, default_value])
+                self.config[key] = default_value
+            else:
+                existing_value = existing_value[0]
+                if isinstance(default_value, int):
+                    existing_value = int(existing_value)
+                self.config[key] = existing_value
+
     def _load_pragmas(self):
-        self.sql.executescript(DB_PRAGMAS)
+        profile = self.config['pragma_profile']
+        if profile not in PRAGMA_PROFILES:
+            log.warning('%s has unknown pragma profile "%s".', self.filepath.basename, profile)
+            profile = 'default'
+
+        pragmas = PRAGMA_PROFILES[profile]
+        script = '\n'.join(f'PRAGMA {key} = {value};' for (key, value) in pragmas.items())
+        self.sql.executescript(script)
         self.sql.commit()
 
+    def set_pragma_profile(self, profile):
+        '''
+        Apply one of the PRAGMA_PROFILES to this connection and store it in the
+        config table so that future connections will use it too.
+        '''
+        if profile not in PRAGMA_PROFILES:
+            raise exceptions.UnknownPragmaProfile(profile, list(PRAGMA_PROFILES))
+
+        self.cur.execute('UPDATE config SET value = ? WHERE key == ?', [profile, 'pragma_profile'])
+        self.config['pragma_profile'] = profile
+        self._load_pragmas()
+
     def __repr__(self):
         return 'TSDB(%s)' % self.filepath
 
+    def close(self):
+        with self._reader_lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+        self.sql.close()
+
+    def create_optional_indices(self):
+        log.debug('Creating optional indices for %s.', self.filepath.basename)
+        self.sql.executescript(OPTIONAL_INDICES)
+        self.sql.commit()
+
     @staticmethod
     def _pick_filepath(formats, name):
         '''
@@ -253,14 +432,14 @@ class TSDB:
         return pathclass.Path(path)
 
     @classmethod
-    def _for_object_helper(cls, name, path_formats, do_create=True, fix_name=False):
+    def _for_object_helper(cls, name, path_formats, do_create=True, fix_name=False, pragma_profile=None):
         if name != os.path.basename(name):
             filepath = pathclass.Path(name)
 
         else:
             filepath = cls._pick_filepath(formats=path_formats, name=name)
 
-        database = cls(filepath=filepath, do_create=do_create)
+        database = cls(filepath=filepath, do_create=do_create, pragma_profile=pragma_profile)
         if fix_name:
             return (database, name_from_path(name))
         return database
@@ -274,7 +453,7 @@ class TSDB:
         return database
 
     @classmethod
-    def for_subreddit(cls, name, do_create=True, fix_name=False):
+    def for_subreddit(cls, name, do_create=True, fix_name=False, pragma_profile=None):
         if isinstance(name, common.praw.models.Subreddit):
             name = name.display_name
         elif not isinstance(name, str):
@@ -283,11 +462,12 @@ class TSDB:
             name,
             do_create=do_create,
             fix_name=fix_name,
+            pragma_profile=pragma_profile,
             path_formats=DB_FORMATS_SUBREDDIT,
         )
 
     @classmethod
-    def for_user(cls, name, do_create=True, fix_name=False):
+    def for_user(cls, name, do_create=True, fix_name=False, pragma_profile=None):
         if isinstance(name, common.praw.models.Redditor):
             name = name.name
         elif not isinstance(name, str):
@@ -297,31 +477,114 @@ class TSDB:
             name,
             do_create=do_create,
             fix_name=fix_name,
+            pragma_profile=pragma_profile,
             path_formats=DB_FORMATS_USER,
         )
 
-    def check_for_edits(self, obj, existing_entry):
+    def get_sync_state(self, source, kind):
         '''
-        If the item's current text doesn't match the stored text, decide what
-        to do.
+        Return the created timestamp up to which the given source has been
+        scanned for the given kind ('submissions' or 'comments'), or None if
+        it has never been recorded.
+        '''
+        self.cur.execute('SELECT created FROM sync_state WHERE source == ? AND kind == ?', [source, kind])
+        fetch = self.cur.fetchone()
+        if fetch is None:
+            return None
+        return fetch[0]
 
-        Firstly, make sure to ignore deleted comments.
-        Then, if the database is configured to store edited text, do so.
-        Finally, return the body that we want to store in the main table.
+    def set_sync_state(self, source, kind, created, commit=False):
         '''
-        if isinstance(obj, SUBMISSION_TYPES):
-            existing_body = existing_entry[SQL_SUBMISSION['selftext']]
-            body = obj.selftext
-        else:
-            existing_body = existing_entry[SQL_COMMENT['body']]
-            body = obj.body
+        Record that the source has been scanned up to this created timestamp.
+        The stored value never moves backwards, so rescanning an older range
+        does not undo progress.
+
+        Do this with commit=False in the same transaction as the insert of the
+        chunk that got us here, so the two can't disagree after a crash.
+        '''
+        query = '''
+            INSERT INTO sync_state(source, kind, created) VALUES(?, ?, ?)
+            ON CONFLICT(source, kind) DO UPDATE SET
+            created = max(created, excluded.created)
+        '''
+        self.cur.execute(query, [source, kind, int(created)])
+        if commit:
+            self.sql.commit()
+
+    def get_fresh_fullnames(self, fullnames, ttl=None, max_age=None):
+        '''
+        Return the set of these fullnames whose rows do not need to be
+        refreshed from reddit yet, because:
 
-        if body != existing_body:
-            if should_keep_existing_text(obj):
-                body = existing_body
-            elif self.config['store_edits']:
-                self.insert_edited(obj, old_text=existing_body)
-        return body
+        ttl:
+            They were refreshed less than this many seconds ago.
+
+        max_age:
+            They were already at least this many seconds old the last time
+            they were refreshed, so their score and text have settled.
+
+        Items that have never been refreshed are never fresh.
+
+        supplement_reddit_data calls this from its own thread in pipelined
+        mode, so the lookup uses a separate read connection.
+        '''
+        if ttl is None and max_age is None:
+            return set()
+
+        conditions = []
+        condition_bindings = []
+        if ttl is not None:
+            conditions.append('refreshed_at >= ?')
+            condition_bindings.append(common.get_now() - ttl)
+        if max_age is not None:
+            conditions.append('refreshed_at - created >= ?')
+            condition_bindings.append(max_age)
+        conditions = ' OR '.join(conditions)
+
+        fresh = set()
+        with self._reader_lock:
+            if self._reader is None:
+                self._reader = sqlite3.connect(self.filepath.absolute_path, check_same_thread=False)
+                self._reader.execute(f'PRAGMA busy_timeout = {PRAGMA_PROFILES["default"]["busy_timeout"]}')
+            cur = self._reader.cursor()
+
+            for (table, prefix) in [('submissions', 't3_'), ('comments', 't1_')]:
+                these = [fullname for fullname in fullnames if fullname.startswith(prefix)]
+                if not these:
+                    continue
+                qmarks = ', '.join('?' * len(these))
+                query = f'''
+                    SELECT idstr FROM {table}
+                    WHERE idstr IN ({qmarks})
+                    AND refreshed_at IS NOT NULL
+                    AND ({conditions})
+                '''
+                cur.execute(query, these + condition_bindings)
+                fresh.update(idstr for (idstr,) in cur.fetchall())
+
+        return fresh
+
+    def get_ingest_checkpoint(self, file_id):
+        self.cur.execute('SELECT offset FROM ingest_checkpoints WHERE file_id == ?', [file_id])
+        fetch = self.cur.fetchone()
+        if fetch is None:
+            return None
+        return fetch[0]
+
+    def set_ingest_checkpoint(self, file_id, filepath, offset, commit=False):
+        '''
+        Do this with commit=False in the same transaction as the rows that
+        were read up to this offset, so the two can't disagree after a crash.
+        '''
+        query = '''
+            INSERT INTO ingest_checkpoints(file_id, filepath, offset) VALUES(?, ?, ?)
+            ON CONFLICT(file_id) DO UPDATE SET
+            filepath = excluded.filepath,
+            offset = excluded.offset
+        '''
+        self.cur.execute(query, [file_id, filepath.absolute_path, offset])
+        if commit:
+            self.sql.commit()
 
     def insert(self, objects, commit=True):
         if not isinstance(objects, (list, tuple, types.GeneratorType)):
@@ -332,181 +595,208 @@ class TSDB:
         else:
             log.debug('Trying to insert %d objects.', len(objects))
 
-        new_values = {
-            'tsdb': self,
-            'new_submissions': 0,
-            'new_comments': 0,
-        }
-        methods = {
-            common.praw.models.Submission: (self.insert_submission, 'new_submissions'),
-            common.praw.models.Comment: (self.insert_comment, 'new_comments'),
-        }
-        methods[pushshift.DummySubmission] = methods[common.praw.models.Submission]
-        methods[pushshift.DummyComment] = methods[common.praw.models.Comment]
-
-        for obj in objects:
-            (method, key) = methods.get(type(obj), (None, None))
-            if method is None:
-                raise TypeError('Unsupported', type(obj), obj)
-            status = method(obj)
-            new_values[key] += status
-
-        if commit:
-            log.debug('Committing insert.')
-            self.sql.commit()
+        rows = (self._row_from_object(obj) for obj in objects)
+        return self.insert_rows(rows, commit=commit)
 
-        log.debug('Done inserting.')
-        return new_values
-
-    def insert_edited(self, obj, old_text):
+    def _insert_edited(self, table, idstr, old_text, edited):
         '''
         Having already detected that the item has been edited, add a record to
         the appropriate *_edits table containing the text that is being
         replaced.
         '''
-        if isinstance(obj, SUBMISSION_TYPES):
-            table = 'submission_edits'
-            key = 'previous_selftext'
-        else:
-            table = 'comment_edits'
-            key = 'previous_body'
+        (edits_table, key) = EDITS_TABLES[table]
 
-        if obj.edited is False:
+        if edited is False:
             replaced_at = int(time.time())
         else:
-            replaced_at = int(obj.edited)
+            replaced_at = int(edited)
 
         postdata = {
-            'idstr': obj.fullname,
+            'idstr': idstr,
             key: old_text,
             'replaced_at': replaced_at,
         }
         cur = self.sql.cursor()
         (qmarks, bindings) = sqlhelpers.insert_filler(postdata)
-        query = f'INSERT INTO {table} {qmarks}'
+        query = f'INSERT INTO {edits_table} {qmarks}'
         cur.execute(query, bindings)
 
-    def insert_submission(self, submission):
+    def insert_rows(self, rows, commit=True):
+        '''
+        Insert items that have already been converted into row tuples.
+
+        rows:
+            An iterable of (table, row, edited) where table is 'submissions' or
+            'comments', row follows SQL_SUBMISSION_COLUMNS or
+            SQL_COMMENT_COLUMNS, and edited is the item's edited attribute,
+            which is used as the replaced_at timestamp if the text changed.
+
+        Return the same summary dict as TSDB.insert.
+        '''
+        new_values = {
+            'tsdb': self,
+            'new_submissions': 0,
+            'new_comments': 0,
+        }
+
+        for chunk in common.generator_chunker(rows, INSERT_CHUNK_SIZE):
+            batches = {}
+            for (table, row, edited) in chunk:
+                batches.setdefault(table, []).append((row, edited))
+
+            for (table, batch) in batches.items():
+                new_values[NEW_COUNT_KEYS[table]] += self._insert_batch(table, batch)
+
+        if commit:
+            log.debug('Committing insert.')
+            self.sql.commit()
+
+        log.debug('Done inserting.')
+        return new_values
+
+    def _insert_batch(self, table, batch):
+        '''
+        Look up all of the rows' existing copies with a single SELECT, then
+        write the new rows and the updates with a single executemany upsert.
+        The SELECT is still needed because the edit tracking has to see the
+        old text before it gets replaced.
+
+        If the same item appears more than once in the batch, which happens
+        when supplement_reddit_data yields a pushshift copy followed by the
+        live copy, the later copies are treated as updates against the row
+        we are holding in memory, exactly as if they had been inserted one by
+        one.
+
+        Return the number of new rows.
+        '''
+        column_index = SQL_COLUMN_INDEX[table]
+        update_indices = [column_index[column] for column in UPDATE_COLUMNS[table]]
+        idstr_index = column_index['idstr']
+        author_index = column_index['author']
+        text_index = column_index[TEXT_COLUMNS[table]]
         cur = self.sql.cursor()
-        cur.execute('SELECT * FROM submissions WHERE idstr == ?', [submission.fullname])
-        existing_entry = cur.fetchone()
 
+        fullnames = list(dict.fromkeys(row[idstr_index] for (row, edited) in batch))
+        qmarks = ', '.join('?' * len(fullnames))
+        cur.execute(f'SELECT * FROM {table} WHERE idstr IN ({qmarks})', fullnames)
+        existing_entries = {row[idstr_index]: list(row) for row in cur.fetchall()}
+
+        new_count = 0
+        touched = {}
+        for (row, edited) in batch:
+            fullname = row[idstr_index]
+            existing_entry = existing_entries.get(fullname, None)
+            if existing_entry is None:
+                row = list(row)
+                existing_entries[fullname] = row
+                touched[fullname] = row
+                new_count += 1
+                continue
+
+            text = row[text_index]
+            existing_text = existing_entry[text_index]
+            if text != existing_text:
+                if should_keep_existing_row_text(author=row[author_index], text=text):
+                    text = existing_text
+                elif self.config['store_edits']:
+                    self._insert_edited(table, fullname, old_text=existing_text, edited=edited)
+
+            # Apply the same coalesce rules as the upsert to the copy we hold,
+            # so that duplicates later in this batch are compared against the
+            # correct text.
+            for index in update_indices:
+                value = text if index == text_index else row[index]
+                if value is not None:
+                    existing_entry[index] = value
+            touched[fullname] = existing_entry
+
+        # Each item gets one row carrying the net result of all of its copies
+        # in this batch. New rows are inserted, and existing rows only take
+        # their UPDATE_COLUMNS from it.
+        cur.executemany(UPSERT_QUERIES[table], touched.values())
+
+        return new_count
+
+    def _row_from_object(self, obj):
+        if isinstance(obj, SUBMISSION_TYPES):
+            table = 'submissions'
+            postdata = self._submission_postdata(obj)
+        elif isinstance(obj, COMMENT_TYPES):
+            table = 'comments'
+            postdata = self._comment_postdata(obj)
+        else:
+            raise TypeError('Unsupported', type(obj), obj)
+
+        row = [postdata[column] for column in SQL_COLUMNS[table]]
+        return (table, row, obj.edited)
+
+    def _submission_postdata(self, submission):
         if submission.author is None:
             author = '[DELETED]'
         else:
             author = submission.author.name
 
-        if not existing_entry:
-            if submission.is_self:
-                # Selfpost's URL leads back to itself, so just ignore it.
-                url = None
-            elif hasattr(submission, 'crosspost_parent') and getattr(submission, 'crosspost_parent_list'):
-                url = submission.crosspost_parent_list[0]['permalink']
-            else:
-                url = getattr(submission, 'url', None)
-
-            if url and url.startswith('/r/'):
-                url = 'https://reddit.com' + url
-
-            postdata = {
-                'idint': common.b36(submission.id),
-                'idstr': submission.fullname,
-                'created': submission.created_utc,
-                'self': submission.is_self,
-                'nsfw': submission.over_18,
-                'author': author,
-                'title': submission.title,
-                'url': url,
-                'selftext': submission.selftext,
-                'score': submission.score,
-                'subreddit': submission.subreddit.display_name,
-                'distinguish': submission.distinguished,
-                'textlen': len(submission.selftext),
-                'num_comments': submission.num_comments,
-                'flair_text': submission.link_flair_text,
-                'flair_css_class': submission.link_flair_css_class,
-                'augmented_at': None,
-                'augmented_count': None,
-            }
-            (qmarks, bindings) = sqlhelpers.insert_filler(postdata)
-            query = f'INSERT INTO submissions {qmarks}'
-            cur.execute(query, bindings)
-
+        if submission.is_self:
+            # Selfpost's URL leads back to itself, so just ignore it.
+            url = None
+        elif hasattr(submission, 'crosspost_parent') and getattr(submission, 'crosspost_parent_list'):
+            url = submission.crosspost_parent_list[0]['permalink']
         else:
-            selftext = self.check_for_edits(submission, existing_entry=existing_entry)
-
-            query = '''
-                UPDATE submissions SET
-                nsfw = coalesce(?, nsfw),
-                score = coalesce(?, score),
-                selftext = coalesce(?, selftext),
-                distinguish = coalesce(?, distinguish),
-                num_comments = coalesce(?, num_comments),
-                flair_text = coalesce(?, flair_text),
-                flair_css_class = coalesce(?, flair_css_class)
-                WHERE idstr == ?
-            '''
-            bindings = [
-                submission.over_18,
-                submission.score,
-                selftext,
-                submission.distinguished,
-                submission.num_comments,
-                submission.link_flair_text,
-                submission.link_flair_css_class,
-                submission.fullname
-            ]
-            cur.execute(query, bindings)
-
-        return existing_entry is None
+            url = getattr(submission, 'url', None)
 
-    def insert_comment(self, comment):
-        cur = self.sql.cursor()
-        cur.execute('SELECT * FROM comments WHERE idstr == ?', [comment.fullname])
-        existing_entry = cur.fetchone()
+        if url and url.startswith('/r/'):
+            url = 'https://reddit.com' + url
 
+        postdata = {
+            'idint': common.b36(submission.id),
+            'idstr': submission.fullname,
+            'created': submission.created_utc,
+            'self': submission.is_self,
+            'nsfw': submission.over_18,
+            'author': author,
+            'title': submission.title,
+            'url': url,
+            'selftext': submission.selftext,
+            'score': submission.score,
+            'subreddit': submission.subreddit.display_name,
+            'distinguish': submission.distinguished,
+            'textlen': len(submission.selftext),
+            'num_comments': submission.num_comments,
+            'flair_text': submission.link_flair_text,
+            'flair_css_class': submission.link_flair_css_class,
+            'augmented_at': None,
+            'augmented_count': None,
+            'refreshed_at': refreshed_at(submission),
+        }
+        return postdata
+
+    def _comment_postdata(self, comment):
         if comment.author is None:
             author = '[DELETED]'
         else:
             author = comment.author.name
 
-        if not existing_entry:
-            postdata = {
-                'idint': common.b36(comment.id),
-                'idstr': comment.fullname,
-                'created': comment.created_utc,
-                'author': author,
-                'parent': comment.parent_id,
-                'submission': comment.link_id,
-                'body': comment.body,
-                'score': comment.score,
-                'subreddit': comment.subreddit.display_name,
-                'distinguish': comment.distinguished,
-                'textlen': len(comment.body),
-            }
-            (qmarks, bindings) = sqlhelpers.insert_filler(postdata)
-            query = f'INSERT INTO comments {qmarks}'
-            cur.execute(query, bindings)
+        postdata = {
+            'idint': common.b36(comment.id),
+            'idstr': comment.fullname,
+            'created': comment.created_utc,
+            'author': author,
+            'parent': comment.parent_id,
+            'submission': comment.link_id,
+            'body': comment.body,
+            'score': comment.score,
+            'subreddit': comment.subreddit.display_name,
+            'distinguish': comment.distinguished,
+            'textlen': len(comment.body),
+            'refreshed_at': refreshed_at(comment),
+        }
+        return postdata
+
+    def insert_submission(self, submission):
+        return self.insert([submission], commit=False)['new_submissions'] == 1
 
-        else:
-            body = self.check_for_edits(comment, existing_entry=existing_entry)
-
-            query = '''
-                UPDATE comments SET
-                score = coalesce(?, score),
-                body = coalesce(?, body),
-                distinguish = coalesce(?, distinguish)
-                WHERE idstr == ?
-            '''
-            bindings = [
-                comment.score,
-                body,
-                comment.distinguished,
-                comment.fullname
-            ]
-            cur.execute(query, bindings)
-
-        return existing_entry is None
+    def insert_comment(self, comment):
+        return self.insert([comment], commit=False)['new_comments'] == 1
 
 
 def name_from_path(filepath):
@@ -524,22 +814,30 @@ def name_from_path(filepath):
     name = name.strip('@')
     return name
 
-def should_keep_existing_text(obj):
+def refreshed_at(obj):
+    '''
+    Live objects from reddit are stamped with the current time, while the
+    pushshift copies get None so that they don't overwrite an earlier refresh.
+    '''
+    if isinstance(obj, pushshift.DummyObject):
+        return None
+    return common.get_now()
+
+def should_keep_existing_row_text(author, text):
     '''
     Under certain conditions we do not want to update the entry in the db
     with the most recent copy of the text. For example, if the post has
     been deleted and the text now shows '[deleted]' we would prefer to
     keep whatever we already have.
 
-    This function puts away the work I would otherwise have to duplicate
-    for both submissions and comments.
+    author and text are the values of a row, where an author of None has
+    already become '[DELETED]'.
     '''
-    body = obj.selftext if isinstance(obj, SUBMISSION_TYPES) else obj.body
-    if obj.author is None and body in ['[removed]', '[deleted]']:
+    if author == '[DELETED]' and text in ['[removed]', '[deleted]']:
         return True
 
     greasy = ['has been overwritten', 'pastebin.com/64GuVi2F']
-    if any(grease in body for grease in greasy):
+    if any(grease in text for grease in greasy):
         return True
 
     return False
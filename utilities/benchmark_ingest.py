@@ -0,0 +1,87 @@
+'''
+Compare the two ways ingest_jsonfile can turn lines of a pushshift archive
+into database rows: building pushshift.DummyObjects and converting them the
+way TSDB.insert does, or mapping the dicts straight to row tuples with
+jsonrows. The database is not involved, so this measures only the parsing and
+conversion overhead.
+
+> benchmark_ingest.py RC_2023-01_sample.json --lines 100000
+'''
+import argparse
+import itertools
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from timesearch_modules import ingest_jsonfile
+from timesearch_modules import jsonrows
+from timesearch_modules import pushshift
+from timesearch_modules import tsdb
+
+def dummy_path(lines):
+    # A TSDB is only needed for its bound methods, which don't touch self.sql.
+    database = tsdb.TSDB.__new__(tsdb.TSDB)
+    results = []
+    for line in lines:
+        obj = jsonrows.json_loads(line)
+        if jsonrows.is_submission(obj):
+            obj = pushshift.DummySubmission(**obj)
+        else:
+            obj = pushshift.DummyComment(**obj)
+        results.append((obj, database._row_from_object(obj)))
+    return results
+
+def row_path(lines):
+    return [jsonrows.row_from_json(jsonrows.json_loads(line)) for line in lines]
+
+def measure(function, lines):
+    '''
+    Return the seconds taken, and the peak memory traced while the whole
+    batch of results is held, like TSDB.insert_rows holds a chunk.
+    '''
+    start = time.perf_counter()
+    function(lines)
+    elapsed = time.perf_counter() - start
+
+    # tracemalloc slows everything down, so it gets a separate run.
+    tracemalloc.start()
+    results = function(lines)
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del results
+    return (elapsed, peak)
+
+def benchmark_ingest(filepath, line_count):
+    lines = ingest_jsonfile.jsonfile_to_lines(filepath)
+    lines = [line for (line, offset) in itertools.islice(lines, line_count)]
+    print(f'Benchmarking {len(lines)} lines.')
+
+    results = {}
+    for (name, function) in [('DummyObject', dummy_path), ('jsonrows', row_path)]:
+        (elapsed, peak) = measure(function, lines)
+        results[name] = (elapsed, peak)
+        rate = len(lines) / elapsed
+        print(f'{name:>12}: {elapsed:.3f}s, {rate:,.0f} lines/s, {peak:,} bytes peak memory')
+
+    (dummy_time, dummy_peak) = results['DummyObject']
+    (row_time, row_peak) = results['jsonrows']
+    print(f'jsonrows is {dummy_time / row_time:.2f}x as fast and uses {row_peak / dummy_peak:.0%} of the memory.')
+
+def benchmark_ingest_argparse(args):
+    return benchmark_ingest(args.json_file, line_count=args.lines)
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('json_file')
+    parser.add_argument('--lines', type=int, default=100000)
+    parser.set_defaults(func=benchmark_ingest_argparse)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    raise SystemExit(main(sys.argv[1:]))
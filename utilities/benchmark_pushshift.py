@@ -0,0 +1,121 @@
+'''
+Compare sequential pushshift pagination against the concurrent windows of the
+async client, using a local stand-in server instead of api.pushshift.io so
+that no network access is needed. The server holds a fake set of submissions
+spread over the time range and adds an artificial delay to every response.
+
+> benchmark_pushshift.py --items 20000 --latency 0.2 --concurrency 8
+'''
+import argparse
+import http.server
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from timesearch_modules import common
+from timesearch_modules import pushshift
+from timesearch_modules import ratelimits
+
+LOWER = 1_500_000_000
+UPPER = 1_600_000_000
+
+def fake_submissions(count):
+    items = []
+    for index in range(count):
+        item = {
+            'id': common.base36encode(index + 1_000_000),
+            'created_utc': random.randint(LOWER, UPPER - 1),
+            'author': 'someone',
+            'title': 'title',
+            'is_self': True,
+            'over_18': False,
+            'num_comments': 0,
+            'subreddit': 'benchmark',
+        }
+        items.append(item)
+    items.sort(key=lambda item: item['created_utc'])
+    return items
+
+def make_handler(items, latency):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+            after = int(query.get('after', [-1])[0])
+            before = int(query.get('before', [2**63])[0])
+            size = int(query.get('size', [100])[0])
+            data = [item for item in items if after < item['created_utc'] < before][:size]
+
+            time.sleep(latency)
+            body = json.dumps({'data': data}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+def measure(concurrency):
+    start = time.perf_counter()
+    results = pushshift.get_submissions_from_subreddit(
+        'benchmark',
+        lower=LOWER - 1,
+        upper=UPPER,
+        concurrency=concurrency,
+    )
+    results = [item.id for item in results]
+    elapsed = time.perf_counter() - start
+    return (elapsed, results)
+
+def benchmark_pushshift(item_count, latency, page_size, concurrency):
+    items = fake_submissions(item_count)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), make_handler(items, latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    pushshift.API_URL = f'http://127.0.0.1:{server.server_port}/reddit/'
+    pushshift.DEFAULT_PARAMS['size'] = page_size
+    # The real ratelimit would dominate the measurement.
+    pushshift.ratelimit = ratelimits.AdaptiveRatelimiter(allowance=1000, period=1)
+
+    print(f'Benchmarking {item_count} items, {page_size} per page, {latency}s latency.')
+    (sequential_time, sequential) = measure(concurrency=None)
+    print(f'  sequential: {sequential_time:.3f}s')
+    (concurrent_time, concurrent) = measure(concurrency=concurrency)
+    print(f'concurrent {concurrency}: {concurrent_time:.3f}s')
+
+    server.shutdown()
+    if sequential != concurrent:
+        print('The two methods returned different items!')
+        return 1
+    print(f'Concurrent is {sequential_time / concurrent_time:.2f}x as fast.')
+
+def benchmark_pushshift_argparse(args):
+    return benchmark_pushshift(
+        item_count=args.items,
+        latency=args.latency,
+        page_size=args.page_size,
+        concurrency=args.concurrency,
+    )
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--page_size', '--page-size', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.set_defaults(func=benchmark_pushshift_argparse)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    raise SystemExit(main(sys.argv[1:]))
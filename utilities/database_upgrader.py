@@ -7,6 +7,25 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 from timesearch_modules import tsdb
 
+# Queries that timesearch runs against big tables, with the index that
+# EXPLAIN QUERY PLAN should name for each. Without it, the query scans and
+# sorts the whole table.
+QUERY_PLANS = [
+    # offline_reading.trees_from_database
+    ('SELECT * FROM comments WHERE submission == ? ORDER BY created', 'comment_submission_index'),
+    ('SELECT * FROM comments WHERE submission IS NOT NULL ORDER BY submission, created', 'comment_submission_index'),
+    # get_comments and get_submissions, when sync_state is empty
+    ('SELECT created FROM comments ORDER BY created DESC LIMIT 1', 'comment_created_index'),
+    ('SELECT created FROM submissions ORDER BY created DESC LIMIT 1', 'submission_created_index'),
+    # index, date sort
+    ('SELECT * FROM submissions WHERE score >= ? ORDER BY created ASC', 'submission_created_index'),
+]
+
+# These are only checked if the database has tsdb.OPTIONAL_INDICES.
+OPTIONAL_QUERY_PLANS = [
+    ('SELECT * FROM submissions WHERE score >= ? ORDER BY author ASC', 'submission_author_index'),
+    ('SELECT * FROM submissions WHERE score >= ? ORDER BY score DESC', 'submission_score_index'),
+]
 
 def upgrade_1_to_2(db):
     '''
@@ -21,6 +40,105 @@ def upgrade_1_to_2(db):
         print('Renaming redmash folder to index.')
         os.rename(redmash_dir, db.index_dir)
 
+def upgrade_2_to_3(db):
+    '''
+    In this version, the idstr and idint indices on submissions and comments
+    became UNIQUE so that TSDB.insert can use INSERT ... ON CONFLICT DO UPDATE
+    instead of separate INSERT and UPDATE statements.
+
+    If any duplicate rows got in previously, only the first copy is kept.
+    '''
+    cur = db.sql.cursor()
+    for table in ['submissions', 'comments']:
+        cur.execute(f'''
+            DELETE FROM {table} WHERE rowid NOT IN (
+                SELECT MIN(rowid) FROM {table} GROUP BY idstr
+            )
+        ''')
+        if cur.rowcount > 0:
+            print('Removed %d duplicate %s.' % (cur.rowcount, table))
+
+    cur.execute('DROP INDEX IF EXISTS submission_index')
+    cur.execute('DROP INDEX IF EXISTS comment_index')
+    cur.execute('CREATE UNIQUE INDEX submission_index ON submissions(idstr)')
+    cur.execute('CREATE UNIQUE INDEX submission_idint_index ON submissions(idint)')
+    cur.execute('CREATE UNIQUE INDEX comment_index ON comments(idstr)')
+    cur.execute('CREATE UNIQUE INDEX comment_idint_index ON comments(idint)')
+
+def upgrade_3_to_4(db):
+    '''
+    In this version, indices were added for the columns that timesearch
+    filters and sorts by: comments.submission, comments.created and
+    submissions.created.
+    '''
+    cur = db.sql.cursor()
+    cur.execute('CREATE INDEX IF NOT EXISTS submission_created_index ON submissions(created)')
+    cur.execute('CREATE INDEX IF NOT EXISTS comment_created_index ON comments(created)')
+    cur.execute('CREATE INDEX IF NOT EXISTS comment_submission_index ON comments(submission, created)')
+
+def upgrade_4_to_5(db):
+    '''
+    In this version, the sync_state table was added so that get_submissions
+    and get_comments can find where to resume without searching the data
+    tables. It starts out empty, and the first update scan will fill it in.
+    '''
+    cur = db.sql.cursor()
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state(
+            source TEXT,
+            kind TEXT,
+            created INT
+        )
+    ''')
+    cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS sync_state_index ON sync_state(source, kind)')
+
+def upgrade_5_to_6(db):
+    '''
+    In this version, the ingest_checkpoints table was added so that an
+    interrupted ingest_jsonfile can resume where it left off.
+    '''
+    cur = db.sql.cursor()
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_checkpoints(
+            file_id TEXT,
+            filepath TEXT,
+            offset INT
+        )
+    ''')
+    cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS ingest_checkpoints_index ON ingest_checkpoints(file_id)')
+
+def upgrade_6_to_7(db):
+    '''
+    In this version, submissions and comments got a refreshed_at column, the
+    last time the row was updated from reddit's live data, so that
+    supplementation can skip items which were refreshed recently.
+    '''
+    cur = db.sql.cursor()
+    cur.execute('ALTER TABLE submissions ADD COLUMN refreshed_at INT')
+    cur.execute('ALTER TABLE comments ADD COLUMN refreshed_at INT')
+
+def check_query_plans(db):
+    '''
+    Run EXPLAIN QUERY PLAN on each of the QUERY_PLANS and return a list of
+    (query, plan) for the ones that don't use their index.
+    '''
+    cur = db.sql.cursor()
+    cur.execute("SELECT name FROM sqlite_master WHERE type == 'index'")
+    existing = set(row[0] for row in cur.fetchall())
+
+    checks = QUERY_PLANS + [
+        (query, index) for (query, index) in OPTIONAL_QUERY_PLANS
+        if index in existing
+    ]
+    failures = []
+    for (query, index) in checks:
+        bindings = [None] * query.count('?')
+        cur.execute('EXPLAIN QUERY PLAN ' + query, bindings)
+        plan = '; '.join(row[-1] for row in cur.fetchall())
+        if f'INDEX {index}' not in plan:
+            failures.append((query, plan))
+    return failures
+
 def upgrade_all(database_filename):
     '''
     Given the filename of a database, apply all of the needed
@@ -36,17 +154,22 @@ def upgrade_all(database_filename):
 
     if current_version == needed_version:
         print('Already up to date with version %d.' % needed_version)
-        return
-
-    for version_number in range(current_version + 1, needed_version + 1):
-        print('Upgrading from %d to %d' % (current_version, version_number))
-        upgrade_function = 'upgrade_%d_to_%d' % (current_version, version_number)
-        upgrade_function = eval(upgrade_function)
-        upgrade_function(db)
-        db.sql.cursor().execute('PRAGMA user_version = %d' % version_number)
-        db.sql.commit()
-        current_version = version_number
-    print('Upgrades finished.')
+    else:
+        for version_number in range(current_version + 1, needed_version + 1):
+            print('Upgrading from %d to %d' % (current_version, version_number))
+            upgrade_function = 'upgrade_%d_to_%d' % (current_version, version_number)
+            upgrade_function = eval(upgrade_function)
+            upgrade_function(db)
+            db.sql.cursor().execute('PRAGMA user_version = %d' % version_number)
+            db.sql.commit()
+            current_version = version_number
+        print('Upgrades finished.')
+
+    failures = check_query_plans(db)
+    for (query, plan) in failures:
+        print('Query does not use its index: %s\n    %s' % (query, plan))
+    if failures:
+        return 1
 
 
 def upgrade_all_argparse(args):